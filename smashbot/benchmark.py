@@ -0,0 +1,881 @@
+#!/usr/bin/python3
+import argparse
+import math
+import os
+import random
+import struct
+import tempfile
+import time
+import tracemalloc
+from collections import deque
+from types import SimpleNamespace
+
+import ubjson
+import ubjson.decoder
+
+import melee
+from melee.commdecoder import decode_replay
+from melee.replayserver import ReplayServer
+from melee.slippstream import (
+    CAPTURE_RECORD,
+    CommType,
+    EventType,
+    open_capture,
+    read_capture,
+)
+
+# Micro-benchmarks for the hot paths in libmelee. None of these need a running
+#   dolphin or Slippi console, everything is fed from synthetic data
+
+# Payload sizes (not counting the command byte) announced by our fake console
+EVENT_SIZES = {
+    EventType.GAME_START: 0x1A0,
+    EventType.PRE_FRAME: 0x3F,
+    EventType.POST_FRAME: 0x54,
+    EventType.GAME_END: 0x2,
+    EventType.FRAME_START: 0x8,
+    EventType.ITEM_UPDATE: 0x2C,
+    EventType.FRAME_BOOKEND: 0x8,
+}
+
+
+def payloads_event():
+    """Build the PAYLOADS event that tells the parser how big every event is"""
+    payload_size = 3 * len(EVENT_SIZES) + 1
+    event = bytearray([EventType.PAYLOADS.value, payload_size])
+    for eventtype, size in EVENT_SIZES.items():
+        event += struct.pack(">BH", eventtype.value, size)
+    return event
+
+
+def new_event(eventtype, frame):
+    """Build a zeroed out event of the given type, with the frame number filled in"""
+    event = bytearray(EVENT_SIZES[eventtype] + 1)
+    event[0] = eventtype.value
+    struct.pack_into(">i", event, 0x1, frame)
+    return event
+
+
+def pre_frame_event(frame, port, buttons, main_stick):
+    event = new_event(EventType.PRE_FRAME, frame)
+    event[0x5] = port - 1
+    struct.pack_into(">ff", event, 0x19, *main_stick)
+    struct.pack_into(">I", event, 0x2D, buttons)
+    return event
+
+
+def post_frame_event(frame, port, character, action, x, y):
+    event = new_event(EventType.POST_FRAME, frame)
+    event[0x5] = port - 1
+    event[0x7] = character.value
+    struct.pack_into(">H", event, 0x8, action.value)
+    struct.pack_into(">fff", event, 0xA, x, y, 1.0)
+    struct.pack_into(">f", event, 0x16, 42.0)
+    event[0x21] = 4
+    struct.pack_into(">f", event, 0x22, 3.0)
+    event[0x32] = 1
+    return event
+
+
+def item_update_event(frame, index):
+    event = new_event(EventType.ITEM_UPDATE, frame)
+    struct.pack_into(">H", event, 0x5, melee.enums.ProjectileSubtype.FOX_LASER.value)
+    struct.pack_into(">ffff", event, 0xC, 2.5, 0.0, 10.0 * index, 20.0)
+    return event
+
+
+def game_start_event(ports=(1, 2)):
+    event = new_event(EventType.GAME_START, 0)
+    for i in range(4):
+        # Player type: 0 is human, 3 is an empty port
+        event[0x66 + (0x24 * i)] = 0 if (i + 1) in ports else 3
+    return event
+
+
+def synthetic_frame(frame, item_updates):
+    """Build the event bytes of one whole frame, as Slippi would stream it"""
+    events = new_event(EventType.FRAME_START, frame)
+    events += pre_frame_event(frame, 1, 0x0100, (1.0, 0.0))
+    events += pre_frame_event(frame, 2, 0x0000, (-0.5, 0.5))
+    events += post_frame_event(
+        frame, 1, melee.enums.Character.FOX, melee.enums.Action.STANDING, -20.0, 0.0
+    )
+    events += post_frame_event(
+        frame, 2, melee.enums.Character.FALCO, melee.enums.Action.DASHING, 20.0, 0.0
+    )
+    for i in range(item_updates):
+        events += item_update_event(frame, i)
+    events += new_event(EventType.FRAME_BOOKEND, frame)
+    return bytes(events)
+
+
+def new_console():
+    """A Console that's ready to parse events, without connecting to anything"""
+    console = melee.console.Console(
+        is_dolphin=False, ai_port=1, opponent_port=2, opponent_type=None
+    )
+    handle = console._Console__handle_slippstream_events
+    handle(payloads_event(), melee.gamestate.GameState(1, 2))
+    return console
+
+
+def bench_parse(args):
+    """Time Console's event parser on frames with a varying number of items"""
+    console = new_console()
+    console.time_events = args.time_events
+    handle = console._Console__handle_slippstream_events
+    for item_updates in (0, 10, 50):
+        frames = [synthetic_frame(i, item_updates) for i in range(args.frames)]
+        start = time.perf_counter()
+        for events in frames:
+            handle(events, melee.gamestate.GameState(1, 2))
+        elapsed = time.perf_counter() - start
+        print(
+            "parse: {:3d} item updates: {:8.2f} us/frame".format(
+                item_updates, elapsed / args.frames * 1e6
+            )
+        )
+    for eventtype, (count, seconds) in console.eventtimings().items():
+        print(
+            "parse: {:>24s}: {:8.2f} us/event".format(
+                str(eventtype), seconds / count * 1e6
+            )
+        )
+
+
+# The POST_FRAME attributes unpack_post_frame() fills in
+UNPACKED_POST_FRAME = (
+    "x",
+    "y",
+    "character",
+    "action",
+    "facing",
+    "percent",
+    "stock",
+    "action_frame",
+    "hitlag",
+    "hitstun_frames_left",
+    "on_ground",
+    "jumps_left",
+)
+
+
+def old_gamestate():
+    """A stand-in for the GameState the old decodes filled in. Its players and
+    projectiles were plain objects then, with no slots or lazy fields"""
+    return SimpleNamespace(
+        frame=0, player={1: SimpleNamespace(), 2: SimpleNamespace()}, projectiles=[]
+    )
+
+
+def unpack_post_frame(event_bytes, offset, gamestate):
+    """The POST_FRAME decode Console used to do, one unpack_from() per field"""
+    unpack_from = struct.unpack_from
+    enums = melee.enums
+    gamestate.frame = unpack_from(">i", event_bytes, offset + 0x1)[0]
+    controller_port = unpack_from(">B", event_bytes, offset + 0x5)[0] + 1
+
+    player = gamestate.player[controller_port]
+    player.x = unpack_from(">f", event_bytes, offset + 0xA)[0]
+    player.y = unpack_from(">f", event_bytes, offset + 0xE)[0]
+
+    player.character = enums.Character(unpack_from(">B", event_bytes, offset + 0x7)[0])
+    try:
+        player.action = enums.Action(unpack_from(">H", event_bytes, offset + 0x8)[0])
+    except ValueError:
+        player.action = enums.Action.UNKNOWN_ANIMATION
+
+    facing_float = unpack_from(">f", event_bytes, offset + 0x12)[0]
+    player.facing = facing_float > 0
+
+    player.percent = int(unpack_from(">f", event_bytes, offset + 0x16)[0])
+    player.stock = unpack_from(">B", event_bytes, offset + 0x21)[0]
+    player.action_frame = int(unpack_from(">f", event_bytes, offset + 0x22)[0])
+
+    bitflags2 = unpack_from(">B", event_bytes, offset + 0x27)[0]
+    player.hitlag = bool(bitflags2 & 0x20)
+
+    player.hitstun_frames_left = int(unpack_from(">f", event_bytes, offset + 0x2B)[0])
+    player.on_ground = not bool(unpack_from(">B", event_bytes, offset + 0x2F)[0])
+    player.jumps_left = unpack_from(">B", event_bytes, offset + 0x32)[0]
+
+
+def unpack_item_update(event_bytes, offset, gamestate):
+    """The ITEM_UPDATE decode Console used to do, one unpack_from() per field"""
+    unpack_from = struct.unpack_from
+    projectile = SimpleNamespace()
+    projectile.x = unpack_from(">f", event_bytes, offset + 0x14)[0]
+    projectile.y = unpack_from(">f", event_bytes, offset + 0x18)[0]
+    projectile.x_speed = unpack_from(">f", event_bytes, offset + 0x0C)[0]
+    projectile.y_speed = unpack_from(">f", event_bytes, offset + 0x10)[0]
+    try:
+        projectile.subtype = melee.enums.ProjectileSubtype(
+            unpack_from(">H", event_bytes, offset + 0x05)[0]
+        )
+    except ValueError:
+        projectile.subtype = melee.enums.ProjectileSubtype.UNKNOWN_PROJECTILE
+    gamestate.projectiles.append(projectile)
+
+
+def bench_decode(args):
+    """Time decoding single PRE_FRAME, POST_FRAME and ITEM_UPDATE events,
+    against the per-field unpack_from() decode Console used to do
+
+    POST_FRAME is decoded lazily, so it's also timed together with reading back
+    the fields the old decode filled in. (The old decode is called directly,
+    without going through the event loop, which flatters it a little)"""
+    console = new_console()
+    handle = console._Console__handle_slippstream_events
+    post_frame = bytes(
+        post_frame_event(
+            0, 1, melee.enums.Character.FOX, melee.enums.Action.STANDING, 0.0, 0.0
+        )
+    )
+    pre_frame = bytes(pre_frame_event(0, 1, 0x0100, (1.0, 0.0)))
+    item_update = bytes(item_update_event(0, 0))
+
+    def read_back(gamestate):
+        player = gamestate.player[1]
+        for attribute in UNPACKED_POST_FRAME:
+            getattr(player, attribute)
+
+    decodes = (
+        ("PRE_FRAME", "compiled", pre_frame, handle, None),
+        ("POST_FRAME", "unpack", post_frame, unpack_post_frame, None),
+        ("POST_FRAME", "lazy", post_frame, handle, None),
+        ("POST_FRAME", "unpack + read", post_frame, unpack_post_frame, read_back),
+        ("POST_FRAME", "lazy + read", post_frame, handle, read_back),
+        ("ITEM_UPDATE", "unpack", item_update, unpack_item_update, None),
+        ("ITEM_UPDATE", "compiled", item_update, handle, None),
+    )
+    for name, how, event, decode, read in decodes:
+        if decode is handle:
+            gamestate = melee.gamestate.GameState(1, 2)
+            decode = lambda event, offset, gamestate: handle(event, gamestate)
+        else:
+            gamestate = old_gamestate()
+        start = time.perf_counter()
+        if read is None:
+            for _ in range(args.frames):
+                decode(event, 0, gamestate)
+        else:
+            for _ in range(args.frames):
+                decode(event, 0, gamestate)
+                read(gamestate)
+        elapsed = time.perf_counter() - start
+        print(
+            "decode: {:12s}: {:>13s}: {:8.2f} us/event".format(
+                name, how, elapsed / args.frames * 1e6
+            )
+        )
+
+
+def bench_fields(args):
+    """Time a whole frame plus reading POST_FRAME fields back out of it, for a
+    bot that reads a few fields against one that reads all of them"""
+    console = new_console()
+    console.reuse_gamestate = True
+    console.handle_message({"type": 2, "payload": {"data": game_start_event()}})
+    msg = {"type": 2, "payload": {"data": synthetic_frame(0, 0)}}
+    everything = [
+        attribute
+        for _, _, attribute, _ in melee.eventlayout.POST_FRAME_FIELDS
+        if attribute is not None
+    ]
+    for name, attributes in (("x, y", ["x", "y"]), ("all", everything)):
+        start = time.perf_counter()
+        for _ in range(args.frames):
+            gamestate = console.handle_message(msg)
+            for player in gamestate.player.values():
+                for attribute in attributes:
+                    getattr(player, attribute)
+        elapsed = time.perf_counter() - start
+        print(
+            "fields: read {:>4s}: {:8.2f} us/frame".format(
+                name, elapsed / args.frames * 1e6
+            )
+        )
+
+
+def comm_messages(frames, reorder=False):
+    """SlippiComm message bodies for a synthetic game, laid out like Dolphin
+    sends them, or with every object's keys in reverse order"""
+    messages = []
+    for i in range(frames):
+        payload = {
+            "pos": struct.pack(">Q", i),
+            "nextPos": struct.pack(">Q", i + 1),
+            "data": synthetic_frame(i, 2),
+        }
+        message = {"type": CommType.REPLAY.value, "payload": payload}
+        if reorder:
+            payload = dict(reversed(payload.items()))
+            message = {"payload": payload, "type": CommType.REPLAY.value}
+        messages.append(ubjson.dumpb(message))
+    return messages
+
+
+def same_message(decoded, expected):
+    """Whether decode_replay() gave the same message as ubjson.loadb(), give or
+    take memoryviews"""
+    if isinstance(decoded, memoryview):
+        decoded = decoded.tobytes()
+    if isinstance(decoded, dict) and isinstance(expected, dict):
+        return decoded.keys() == expected.keys() and all(
+            same_message(decoded[key], expected[key]) for key in decoded
+        )
+    if isinstance(decoded, list) and isinstance(expected, list):
+        return len(decoded) == len(expected) and all(
+            same_message(*pair) for pair in zip(decoded, expected)
+        )
+    return type(decoded) is type(expected) and decoded == expected
+
+
+def bench_comm(args):
+    """Compare SlippiComm message decoding throughput, generic ubjson (with and
+    without its C extension) against melee.commdecoder
+
+    Checks every message decode_replay() gives back against ubjson, and reports
+    how many REPLAY messages missed its fast path and fell back to ubjson. Give
+    --capture to run over the messages in a real capture file too"""
+    layouts = [
+        ("dolphin", comm_messages(args.frames)),
+        ("reordered", comm_messages(args.frames, reorder=True)),
+    ]
+    if args.capture:
+        messages = [message[4:] for _, message in read_capture(args.capture)]
+        layouts.append((os.path.basename(args.capture), messages))
+    decoders = (
+        ("ubjson", ubjson.loadb),
+        ("ubjson (python)", ubjson.decoder.loadb),
+        ("decode_replay", decode_replay),
+    )
+    for layout, messages in layouts:
+        replays = fallbacks = 0
+        for message in messages:
+            decoded = decode_replay(message)
+            if not same_message(decoded, ubjson.loadb(message)):
+                raise AssertionError("decode_replay mismatch: {!r}".format(message))
+            if decoded["type"] == CommType.REPLAY.value:
+                replays += 1
+                # Only the fast path leaves data in the message
+                if not isinstance(decoded["payload"]["data"], memoryview):
+                    fallbacks += 1
+        for name, decoder in decoders:
+            start = time.perf_counter()
+            for message in messages:
+                decoder(message)
+            elapsed = time.perf_counter() - start
+            print(
+                "comm: {:>10s}: {:>15s}: {:10.0f} msgs/sec".format(
+                    layout, name, len(messages) / elapsed
+                )
+            )
+        print(
+            "comm: {:>10s}: {} messages, {} replays, {} fell back to ubjson".format(
+                layout, len(messages), replays, fallbacks
+            )
+        )
+
+
+class BehindStream:
+    """Stands in for Console's SlippstreamClient, handing step() one message
+    per frame, with the next few frames always already waiting, as if the bot
+    kept falling behind"""
+
+    def __init__(self, messages, behind):
+        self.messages = deque(messages)
+        self.behind = behind
+        self.waiting = 0
+        self.server = self
+        self.bytes_copied = 0
+        self.time_decode = False
+
+    def read_message(self):
+        if not self.messages:
+            self.server = None
+            return None
+        self.waiting = self.behind
+        return self.messages.popleft()
+
+    def pending(self):
+        return self.waiting > 0 and bool(self.messages)
+
+    def read_available(self):
+        self.waiting -= 1
+        return [self.messages.popleft()]
+
+
+def bench_alloc(args):
+    """Measure how much memory Console allocates per frame, with and without
+    reusing its GameStates. And with latest_frame skipping frames too, checking
+    that the GameState the last step() returned doesn't get written over"""
+    frames = [
+        {"type": 2, "payload": {"data": synthetic_frame(i, 2)}}
+        for i in range(args.frames)
+    ]
+    for reuse in (False, True):
+        console = new_console()
+        console.reuse_gamestate = reuse
+        console.handle_message({"type": 2, "payload": {"data": game_start_event()}})
+        tracemalloc.start()
+        peaks = 0
+        for msg in frames:
+            start = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            console.handle_message(msg)
+            peaks += tracemalloc.get_traced_memory()[1] - start
+        tracemalloc.stop()
+        print(
+            "alloc: reuse_gamestate={!s:5}: {:8.0f} bytes/frame peak".format(
+                reuse, peaks / args.frames
+            )
+        )
+
+    console = new_console()
+    console.reuse_gamestate = True
+    console.latest_frame = True
+    console.handle_message({"type": 2, "payload": {"data": game_start_event()}})
+    console.slippstream = BehindStream(frames, behind=2)
+    tracemalloc.start()
+    peaks = 0
+    previous = console.step()
+    while previous is not None:
+        frame = previous.frame
+        start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        gamestate = console.step()
+        peaks += tracemalloc.get_traced_memory()[1] - start
+        if previous.frame != frame:
+            raise AssertionError(
+                "latest_frame wrote over frame {} with frame {}".format(
+                    frame, previous.frame
+                )
+            )
+        previous = gamestate
+    tracemalloc.stop()
+    print(
+        "alloc: reuse_gamestate=True , latest_frame: {:8.0f} bytes/frame peak, "
+        "{} buffers".format(peaks / args.frames, len(console._gamestate_buffers))
+    )
+
+
+def bench_memory(args):
+    """Measure how much memory it takes to keep every frame's GameState around"""
+    console = new_console()
+    console.handle_message({"type": 2, "payload": {"data": game_start_event()}})
+    msg = {"type": 2, "payload": {"data": synthetic_frame(0, 2)}}
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    states = [console.handle_message(msg) for _ in range(args.frames)]
+    used = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    print(
+        "memory: {} frames, 2 players, 2 projectiles: {:8.0f} bytes/frame".format(
+            len(states), used / len(states)
+        )
+    )
+
+
+def bench_shared(args):
+    """Measure how much memory each worker needs for frame data, building its own
+    FrameData against attaching to FrameDataArrays in shared memory, both on its
+    own and with the ArrayFrameData each worker would actually query"""
+    from melee.framearrays import ArrayFrameData, FrameDataArrays
+
+    shared = FrameDataArrays.from_csv().share()
+    try:
+        for name, load in (
+            ("FrameData", melee.framedata.FrameData),
+            ("attach", lambda: FrameDataArrays.attach(shared.name)),
+            (
+                "ArrayFrameData",
+                lambda: ArrayFrameData(FrameDataArrays.attach(shared.name)),
+            ),
+        ):
+            tracemalloc.start()
+            start = time.perf_counter()
+            loaded = load()
+            elapsed = time.perf_counter() - start
+            used = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            if isinstance(loaded, FrameDataArrays):
+                arrays = loaded
+            else:
+                arrays = getattr(loaded, "arrays", None)
+            # Every view into the block has to go before it's closed, or closing
+            #   it raises BufferError
+            del loaded
+            if arrays is not None:
+                arrays.close()
+                del arrays
+            print(
+                "shared: {:>14s}: {:10.0f} bytes/worker, {:8.2f} ms".format(
+                    name, used, elapsed * 1000
+                )
+            )
+        print("shared: {:>14s}: {:10.0f} bytes, once".format("block", shared.nbytes))
+    finally:
+        shared.unlink()
+        shared.close()
+
+
+def bench_queries(args):
+    """Compare FrameData query latency, dict backed against array backed"""
+    from melee.framearrays import ArrayFrameData
+
+    backends = (("dicts", melee.framedata.FrameData()), ("arrays", ArrayFrameData()))
+    dicts = backends[0][1].framedata
+    keys = [(character, action) for character in dicts for action in dicts[character]]
+    queries = (
+        ("isattack", lambda data, c, a: data.isattack(c, a)),
+        ("firsthitboxframe", lambda data, c, a: data.firsthitboxframe(c, a)),
+        ("hitboxcount", lambda data, c, a: data.hitboxcount(c, a)),
+        ("iasa", lambda data, c, a: data.iasa(c, a)),
+        ("lastframe", lambda data, c, a: data.lastframe(c, a)),
+        ("getframe", lambda data, c, a: data.getframe(c, a, 5)),
+        ("attackstate", lambda data, c, a: data.attackstate(c, a, 5)),
+        ("getrange_forward", lambda data, c, a: data.getrange_forward(c, a, 0)),
+    )
+    # ArrayFrameData builds each action's summary the first time it's asked
+    #   about. Do that up front, so it's timed on its own
+    start = time.perf_counter()
+    for character, action in keys:
+        backends[1][1].summary(character, action)
+    elapsed = time.perf_counter() - start
+    print(
+        "queries: {:>16s}: {:>6s}: {:8.2f} us/action, once".format(
+            "summary", "arrays", elapsed / len(keys) * 1e6
+        )
+    )
+    for query, call in queries:
+        for name, data in backends:
+            start = time.perf_counter()
+            for character, action in keys:
+                call(data, character, action)
+            elapsed = time.perf_counter() - start
+            print(
+                "queries: {:>16s}: {:>6s}: {:8.2f} us/query".format(
+                    query, name, elapsed / len(keys) * 1e6
+                )
+            )
+
+
+def bench_inrange(args):
+    """Time asking which of a character's attacks would hit, one inrange() per
+    attack against a single inrange_many()"""
+    import copy
+
+    framedata = melee.framedata.FrameData()
+    character = melee.Character.MARTH
+    actions = [
+        action
+        for action in framedata.framedata[character]
+        if framedata.isattack(character, action)
+    ][:30]
+
+    class Player:
+        pass
+
+    attacker = Player()
+    attacker.character = character
+    attacker.action = melee.Action.STANDING
+    attacker.action_frame = 0
+    attacker.x, attacker.y = 0.0, 10.0
+    attacker.on_ground, attacker.facing = False, True
+    attacker.speed_ground_x_self = 0.0
+    attacker.speed_air_x_self, attacker.speed_y_self = 0.5, 1.0
+    defender = Player()
+    defender.character = melee.Character.FOX
+    defender.x, defender.y = 15.0, 0.0
+    stage = melee.Stage.FINAL_DESTINATION
+
+    attackers = []
+    for action in actions:
+        attackers.append(copy.copy(attacker))
+        attackers[-1].action = action
+    rounds = max(args.frames // 100, 1)
+    # (inrange_many builds its tables the first time it sees these actions)
+    framedata.inrange_many(attacker, defender, stage, actions)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        expected = [framedata.inrange(each, defender, stage) for each in attackers]
+    looped = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(rounds):
+        batched = framedata.inrange_many(attacker, defender, stage, actions)
+    elapsed = time.perf_counter() - start
+    assert batched == expected
+    for name, elapsed in (("inrange", looped), ("inrange_many", elapsed)):
+        print(
+            "inrange: {} attacks: {:>12s}: {:8.2f} us/call".format(
+                len(actions), name, elapsed / rounds * 1e6
+            )
+        )
+
+
+def loop_jump(speed, gravity):
+    """The per-frame loop getdjheight() and getdjapexframes() used to run.
+    Returns (height, frames)"""
+    height, frames = 0, 0
+    while speed > 0:
+        height += speed
+        frames += 1
+        speed -= gravity
+    return height, frames
+
+
+def bench_jumps(args):
+    """Check getdjheight() and getdjapexframes() against the per-frame loop they
+    replaced, for every character, and time the two"""
+    framedata = melee.framedata.FrameData()
+    states = []
+    for character, data in framedata.characterdata.items():
+        # Peach's double jump is hardcoded, rather than worked out
+        if character == melee.Character.PEACH:
+            continue
+        for jumps_left in range(7):
+            # Only a jump that's already going (no jumps left) depends on speed
+            speeds = [i / 1000 for i in range(-500, 6000)] if jumps_left == 0 else [0.0]
+            for speed in speeds:
+                states.append(
+                    SimpleNamespace(
+                        character=character,
+                        action=melee.Action.JUMPING_ARIAL_FORWARD,
+                        action_frame=0,
+                        jumps_left=jumps_left,
+                        speed_y_self=speed,
+                    )
+                )
+
+    def expected(state):
+        data = framedata.characterdata[state.character]
+        speed = data["InitDJSpeed"]
+        if state.jumps_left == 0:
+            speed = state.speed_y_self - data["Gravity"]
+        if state.character == melee.Character.JIGGLYPUFF:
+            speed = {5: 1.586, 4: 1.526, 3: 1.406, 2: 1.296}.get(
+                min(state.jumps_left, 5), 1.186
+            )
+        return loop_jump(speed, data["Gravity"]), speed / data["Gravity"]
+
+    for state in states:
+        (height, frames), ratio = expected(state)
+        assert math.isclose(
+            framedata.getdjheight(state), height, rel_tol=1e-12, abs_tol=1e-12
+        )
+        # When the speed is an exact multiple of gravity, the loop's repeated
+        #   subtraction can leave a ~1e-15 "rising" frame that the closed form doesn't
+        if abs(ratio - round(ratio)) < 1e-9:
+            assert abs(framedata.getdjapexframes(state) - frames) <= 1
+        else:
+            assert framedata.getdjapexframes(state) == frames
+    # Like this one: 5.742 is exactly 87 of Samus's 0.066 gravity
+    samus = SimpleNamespace(
+        character=melee.Character.SAMUS, jumps_left=0, speed_y_self=5.808
+    )
+    assert expected(samus)[0][1] == 88
+    assert framedata.getdjapexframes(samus) == 87
+
+    start = time.perf_counter()
+    for state in states:
+        expected(state)
+    looped = time.perf_counter() - start
+    start = time.perf_counter()
+    for state in states:
+        framedata.getdjheight(state)
+        framedata.getdjapexframes(state)
+    elapsed = time.perf_counter() - start
+    print(
+        "jumps: {} jumps checked: loop {:6.2f} us, closed form {:6.2f} us".format(
+            len(states), looped / len(states) * 1e6, elapsed / len(states) * 1e6
+        )
+    )
+
+
+def loop_slide(framedata, character_state, initspeed, frames):
+    """The per-frame loop slidedistance() used to run"""
+    normalfriction = framedata.characterdata[character_state.character]["Friction"]
+    walkspeed = framedata.characterdata[character_state.character]["MaxWalkSpeed"]
+    friction = normalfriction
+    totaldistance = 0
+    absspeed = abs(initspeed)
+    multiplier = 1
+    for i in range(frames):
+        if character_state.action == melee.Action.TECH_MISS_UP:
+            if character_state.action_frame + i < 18:
+                friction = 0.051
+                multiplier = 1
+            else:
+                friction = normalfriction
+        elif absspeed > walkspeed:
+            multiplier = 2
+        else:
+            multiplier = 1
+        absspeed -= friction * multiplier
+        if absspeed < 0:
+            break
+        totaldistance += absspeed
+    if initspeed < 0:
+        totaldistance = -totaldistance
+    return totaldistance
+
+
+def bench_slide(args):
+    """Check slidedistance() and slidedistances() against the per-frame loop
+    they replaced, for every character, and time them"""
+    import numpy as np
+
+    framedata = melee.framedata.FrameData()
+    speeds = [random.Random(0).uniform(-4, 4) for _ in range(100)] + [0.0, 0.004]
+    cases = []
+    for character in framedata.characterdata:
+        for action in (melee.Action.STANDING, melee.Action.TECH_MISS_UP):
+            for action_frame in (0, 10, 17, 18, 30):
+                state = SimpleNamespace(
+                    character=character, action=action, action_frame=action_frame
+                )
+                for frames in (0, 1, 5, 17, 40, 200):
+                    cases.append((state, frames))
+
+    checked = 0
+    for state, frames in cases:
+        batched = framedata.slidedistances(state, speeds, frames)
+        for speed, distance in zip(speeds, batched):
+            expected = loop_slide(framedata, state, speed, frames)
+            assert math.isclose(
+                framedata.slidedistance(state, speed, frames),
+                expected,
+                rel_tol=1e-9,
+                abs_tol=1e-9,
+            )
+            assert math.isclose(distance, expected, rel_tol=1e-9, abs_tol=1e-9)
+            checked += 1
+    # Where the speed slows down to exactly walk speed, the loop's repeated
+    #   subtraction decides whether friction stays doubled for one more frame.
+    #   2.3200000000000003 is just above 6 of Marth's doubled frictions (0.12)
+    #   over his walk speed (1.6), so it really does have 7 doubled frames
+    marth = SimpleNamespace(
+        character=melee.Character.MARTH, action=melee.Action.STANDING, action_frame=0
+    )
+    speed = float(np.nextafter(2.32, 3))
+    assert math.isclose(loop_slide(framedata, marth, speed, 40), 31.94)
+    assert math.isclose(framedata.slidedistance(marth, speed, 40), 30.40)
+
+    state = SimpleNamespace(
+        character=melee.Character.FOX, action=melee.Action.STANDING, action_frame=0
+    )
+    for frames in (10, 120):
+        start = time.perf_counter()
+        for speed in speeds:
+            loop_slide(framedata, state, speed, frames)
+        looped = time.perf_counter() - start
+        start = time.perf_counter()
+        for speed in speeds:
+            framedata.slidedistance(state, speed, frames)
+        closed = time.perf_counter() - start
+        start = time.perf_counter()
+        framedata.slidedistances(state, speeds, frames)
+        batched = time.perf_counter() - start
+        print(
+            "slide: {} speeds over {:3d} frames: loop {:8.2f} us, closed form {:8.2f} us, "
+            "slidedistances {:8.2f} us".format(
+                len(speeds), frames, looped * 1e6, closed * 1e6, batched * 1e6
+            )
+        )
+    print("slide: {} slides checked".format(checked))
+
+
+def write_capture(path, frames, item_updates):
+    """Write a capture file of a whole synthetic game, as if recorded from Slippi"""
+    handshake = {
+        "nick": "benchmark",
+        "nintendontVersion": "1.0.0",
+        "cursor": 0,
+        "clientToken": b"\x00\x00\x00\x01",
+    }
+    messages = [{"type": CommType.HANDSHAKE.value, "payload": handshake}]
+    events = [payloads_event() + game_start_event()]
+    events += [synthetic_frame(i, item_updates) for i in range(frames)]
+    for cursor, data in enumerate(events):
+        payload = {"pos": cursor, "nextPos": cursor + 1, "data": bytes(data)}
+        messages.append({"type": CommType.REPLAY.value, "payload": payload})
+    with open_capture(path) as capture:
+        for i, message in enumerate(messages):
+            body = ubjson.dumpb(message)
+            capture.write(CAPTURE_RECORD.pack(i / 60, len(body)))
+            capture.write(body)
+
+
+def bench_step(args):
+    """Time the whole Console.step() loop, against a local replay server"""
+    fd, path = tempfile.mkstemp(suffix=".slpcap")
+    os.close(fd)
+    os.remove(path)
+    try:
+        write_capture(path, args.frames, 2)
+        server = ReplayServer(path, port=0, realtime=False)
+        server.start()
+        console = melee.console.Console(
+            is_dolphin=False, ai_port=1, opponent_port=2, opponent_type=None
+        )
+        console.slippi_address = server.address
+        console.slippi_port = server.port
+        console.zerocopy = True
+        console.connect()
+        frames = 0
+        start = time.perf_counter()
+        while console.step() is not None:
+            frames += 1
+        elapsed = time.perf_counter() - start
+        server.stop()
+        print("step: {} frames: {:8.2f} us/frame".format(frames, elapsed / frames * 1e6))
+    finally:
+        os.remove(path)
+
+
+BENCHMARKS = {
+    "parse": bench_parse,
+    "decode": bench_decode,
+    "comm": bench_comm,
+    "fields": bench_fields,
+    "alloc": bench_alloc,
+    "memory": bench_memory,
+    "step": bench_step,
+    "shared": bench_shared,
+    "queries": bench_queries,
+    "inrange": bench_inrange,
+    "jumps": bench_jumps,
+    "slide": bench_slide,
+}
+
+parser = argparse.ArgumentParser(description="Micro-benchmarks for libmelee")
+parser.add_argument(
+    "benchmarks",
+    nargs="*",
+    help="Which benchmarks to run, out of: "
+    + ", ".join(BENCHMARKS)
+    + " (default: all of them)",
+)
+parser.add_argument(
+    "--frames", "-f", type=int, default=10000, help="How many frames to run for"
+)
+parser.add_argument(
+    "--capture",
+    "-c",
+    help="A Slippstream capture file to also check and time decoding over",
+)
+parser.add_argument(
+    "--time-events",
+    "-t",
+    action="store_true",
+    help="Also report Console's per-event handler timings",
+)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("Unknown benchmark: " + name)
+    for name in args.benchmarks or BENCHMARKS:
+        BENCHMARKS[name](args)
@@ -68,6 +68,13 @@ parser.add_argument(
     help="Do you want to play on an Emulator (dolphin) or " "hardware console (wii)",
 )
 parser.add_argument("--address", "-a", default="", help="IP address of Slippi/Wii")
+parser.add_argument(
+    "--latency",
+    type=int,
+    default=0,
+    metavar="FRAMES",
+    help="Print a breakdown of where each frame's latency goes, every this many frames",
+)
 parser.add_argument(
     "--configdir",
     "-n",
@@ -128,6 +135,11 @@ console.render = True
 #   an autodiscover process
 console.slippi_address = args.address
 
+# Optionally time each stage of getting a frame, and print percentiles of them
+if args.latency:
+    console.time_frames = True
+    console.latency_dump_every = args.latency
+
 # Create our Controller object
 #   The controller is the second primary object your bot will interact with
 #   Your controller is your way of sending button presses to the game, whether
@@ -173,6 +185,9 @@ while True:
     i += 1
     # "step" to the next frame
     gamestate = console.step()
+    if gamestate is None:
+        print("ERROR: Lost the connection to the console.")
+        sys.exit(-1)
     melee.techskill.multishine(ai_state=gamestate.ai_state, controller=controller)
 
     if console.processingtime * 1000 > 12:
@@ -3,6 +3,7 @@ Python3 only
 Currently only works on Linux/OSX
 """
 from melee.console import Console
+from melee.consolepool import ConsolePool
 from melee.logger import Logger
 from melee.gamestate import GameState
 from melee.enums import Stage, Menu, Character, Button, Action, ProjectileSubtype
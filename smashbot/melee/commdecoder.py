@@ -0,0 +1,70 @@
+""" A fast decoder for SlippiComm messages
+
+SlippiComm messages are UBJSON, but nearly all of them are REPLAY messages
+laid out exactly like this:
+    {"type": 2, "payload": {"pos": [8 bytes], "nextPos": [8 bytes], "data": [...]}}
+and all Console does with one is read its type and data. decode_replay() matches
+that layout in one go and hands back data as a memoryview into the message,
+instead of copying it out into a new bytes object. So data is only good for as
+long as the message buffer it came from is.
+
+HANDSHAKE and KEEPALIVE messages, and anything else that isn't laid out like
+that (other key orders or integer sizes), go through the generic ubjson decoder
+instead. `benchmark.py comm` reports how many messages miss the fast path.
+
+ubjson's C extension beats this on plain throughput (see `benchmark.py comm`),
+so DEFAULT_DECODER only picks decode_replay() when the extension isn't built
+and ubjson is running in pure Python.
+"""
+
+import re
+from struct import Struct
+
+import ubjson
+
+# CommType.REPLAY (slippstream imports us, so we can't import it from there)
+_REPLAY = 0x02
+
+# Everything up to the start of data, with the pos, nextPos and data length
+#   picked out. The length is a uint8, int16 or int32, depending on its size
+_REPLAY_HEADER = re.compile(
+    b'\\{U\\x04typeU\\x02U\\x07payload\\{'
+    b'U\\x03pos\\[\\$U#U\\x08(.{8})'
+    b'U\\x07nextPos\\[\\$U#U\\x08(.{8})'
+    b'U\\x04data\\[\\$U#(?:U(.)|I(..)|l(....))',
+    re.DOTALL)
+_INT16 = Struct(">h")
+_INT32 = Struct(">i")
+# The ends of the payload and message objects
+_REPLAY_END = b'}}'
+
+def decode_replay(message):
+    """ Decode a SlippiComm message body (without its length header)
+
+    Returns the message as a dict, just like ubjson.loadb() would, except that
+    a REPLAY message's data is a memoryview. Raises ubjson's DecoderException
+    if the message is malformed
+    """
+    match = _REPLAY_HEADER.match(message)
+    if match is not None:
+        pos, next_pos, size8, size16, size32 = match.groups()
+        if size8 is not None:
+            size = size8[0]
+        elif size16 is not None:
+            size = _INT16.unpack(size16)[0]
+        else:
+            size = _INT32.unpack(size32)[0]
+        start = match.end()
+        end = start + size
+        if size >= 0 and end + 2 == len(message) and message[end:] == _REPLAY_END:
+            return {
+                "type": _REPLAY,
+                "payload": {
+                    "pos": pos,
+                    "nextPos": next_pos,
+                    "data": memoryview(message)[start:end],
+                }
+            }
+    return ubjson.loadb(message)
+
+DEFAULT_DECODER = ubjson.loadb if ubjson.EXTENSION_ENABLED else decode_replay
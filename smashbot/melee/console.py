@@ -1,18 +1,17 @@
 from socket import *
-from struct import unpack
-from collections import defaultdict
+from struct import unpack_from
 
 import time
 import ubjson
 import pwd
 import os
 import configparser
-import csv
 import subprocess
 
-from melee import enums
-from melee.gamestate import GameState, Projectile, Action
-from melee.slippstream import SlippstreamClient, CommType, EventType
+from melee import enums, eventlayout, datacache
+from melee.gamestate import GameState, PlayerState, Projectile, Action
+from melee.latency import LatencyLog
+from melee.slippstream import SlippstreamClient, AsyncSlippstreamClient, CommType, EventType
 
 class Console:
     def __init__(self, is_dolphin, ai_port, opponent_port, opponent_type,
@@ -28,7 +27,59 @@ class Console:
         self._frametimestamp = time.time()
         self.slippi_address = ""
         self.slippi_port = 51441
+        self.slippstream = None
+        # Receive Slippstream messages into a reusable buffer (see SlippstreamClient)
+        self.zerocopy = False
+        # Record everything received from Slippi to this file (see melee.replayserver)
+        self.capture_path = None
+        # If the connection to Slippi drops, reconnect and pick the stream back
+        #   up where it left off, instead of having step() return None
+        self.reconnect = False
+        # How many frames (and ms) went missing in the last reconnect
+        self.reconnect_gap_frames = 0
+        self.reconnect_gap_ms = 0
+        self._reconnects = 0
+        # How many message bytes the receive path copied during the last step()
+        self.bytes_copied = 0
+        self._copied = 0
+        # The frame that handle_message() is in the middle of reading
+        self._gamestate = None
+        # Update a pair of long-lived GameStates in place, instead of building
+        #   a new one every frame. Each GameState you get back from step() is
+        #   then only good until the step() after next. (So it's still fine to
+        #   compare a frame against the one before it)
+        #   These only have PlayerStates for the ports that are in the game
+        #   (With latest_frame on, a third one gets added, so that catching up
+        #   never writes over the GameState the last step() returned)
+        self.reuse_gamestate = False
+        self._gamestate_buffers = None
+        # The GameState the last step() returned
+        self._returned = None
+        # Ports that are in the current game, according to GAME_START
+        self._ports = range(1, 9)
+        # Have step() catch up to the newest frame that's arrived, instead of
+        #   returning frames one at a time even if we've fallen behind
+        self.latest_frame = False
+        # How many older frames the last step() read in but didn't return
+        self.frames_skipped = 0
         self.eventsize = [0] * 0x100
+        # Event handlers, indexed by command byte. Filled in by the PAYLOADS event
+        self.eventhandlers = [None] * 0x100
+        self.eventhandlers[EventType.PAYLOADS.value] = self.__handle_payloads
+        # Set to True to count how long each event handler takes (see eventtimings())
+        self.time_events = False
+        self.eventcount = [0] * 0x100
+        self.eventtime = [0.0] * 0x100
+        self.__compile_layouts()
+        # Set to True to record how long each frame spends waiting on the socket,
+        #   decoding, parsing and fixing up, in self.latency (see melee.latency)
+        self.time_frames = False
+        self.latency = LatencyLog()
+        # Print the latency summary every this many frames, when timing them (0 for never)
+        self.latency_dump_every = 0
+        self._read_time = 0
+        self._parse_time = 0
+        self._decode_mark = 0
 
         # Keep a running copy of the last gamestate produced
         #   game info is only produced as diffs, not whole snapshots
@@ -57,34 +108,33 @@ class Console:
             self.setup_dolphin_controller(opponent_port, opponent_type)
 
         # Prepare some structures for fixing melee data
-        path = os.path.dirname(os.path.realpath(__file__))
-        with open(path + "/actiondata.csv") as csvfile:
-            #A list of dicts containing the frame data
-            actiondata = list(csv.DictReader(csvfile))
-            #Dict of sets
-            self.zero_indices = defaultdict(set)
-            for line in actiondata:
-                if line["zeroindex"] == "True":
-                    self.zero_indices[int(line["character"])].add(int(line["action"]))
+        # Which actions have zero-indexed frame counts, for each character.
+        #   A dense table of flags, indexed by character * width + action
+        self.zero_index_width, self.zero_index = datacache.zero_index_table()
 
         # Read the character data csv
-        self.characterdata = dict()
-        with open(path + "/characterdata.csv") as csvfile:
-            reader = csv.DictReader(csvfile)
-            for line in reader:
-                del line["Character"]
-                #Convert all fields to numbers
-                for key, value in line.items():
-                    line[key] = float(value)
-                self.characterdata[enums.Character(line["CharacterIndex"])] = line
+        self.characterdata = datacache.character_data()
 
     def connect(self):
         """ Connects to the Slippi server (dolphin or wii).
 
         Returns boolean of success """
-        self.slippstream = SlippstreamClient(self.slippi_address, self.slippi_port)
+        self.slippstream = SlippstreamClient(self.slippi_address, self.slippi_port,
+                                             zerocopy=self.zerocopy,
+                                             capture_path=self.capture_path,
+                                             reconnect=self.reconnect)
+        self._reconnects = 0
         return self.slippstream.connect()
 
+    async def connect_async(self):
+        """ Connects to the Slippi server (dolphin or wii) from inside an asyncio
+        event loop. Use step_async() to read frames after this.
+
+        Returns boolean of success """
+        self.slippstream = AsyncSlippstreamClient(self.slippi_address, self.slippi_port,
+                                                  capture_path=self.capture_path)
+        return await self.slippstream.connect()
+
     def run(self, iso_path=None, movie_path=None, dolphin_executable_path=None, dolphin_config_path=None):
         """Run dolphin-emu"""
         if self.is_dolphin:
@@ -191,139 +241,320 @@ class Console:
         #     config.write(dolphinfile)
 
     def step(self):
-        # Keep looping until we get a REPLAY message
-        self.processingtime = time.time() - self._frametimestamp
-        gamestate = GameState(self.ai_port, self.opponent_port)
-        frame_ended = False
-        while not frame_ended:
-            msg = self.slippstream.read_message()
-            if msg:
-                if (CommType(msg['type']) == CommType.REPLAY):
-                    events = msg['payload']['data']
-                    frame_ended = self.__handle_slippstream_events(events, gamestate)
-                    # Start the processing timer now that we're done reading messages
-                    self._frametimestamp = time.time()
-                    continue
-
-                # We can basically just ignore keepalives
-                elif (CommType(msg['type']) == CommType.KEEPALIVE):
-                    print("Keepalive")
-                    continue
-
-                elif (CommType(msg['type']) == CommType.HANDSHAKE):
-                    p = msg['payload']
-                    print("Connected to console '{}' (Slippi Nintendont {})".format(
-                        p['nick'],
-                        p['nintendontVersion'],
-                    ))
-                    continue
+        """ Wait for the next frame from the console, and return its GameState
+
+        If latest_frame is set, any more frames that have already arrived are
+        read too, and only the newest of them is returned. (frames_skipped says
+        how many were passed over)
+        Returns None if the connection to the console was lost
+        """
+        self.__start_step()
+        gamestate = None
+        # Keep looping until we get a REPLAY message that ends the frame
+        while gamestate is None:
+            msg = self.__read_message()
+            if msg is None and self.slippstream.server is None:
+                return None
+            gamestate = self.handle_message(msg)
+        if self.latest_frame:
+            gamestate = self.__skip_to_latest(gamestate)
+        self.__finish_step()
+        self._returned = gamestate
+        return gamestate
+
+    async def step_async(self):
+        """ The same as step(), but waits for the frame inside an asyncio event loop
+
+        Needs the console to have been connected with connect_async().
+        (latest_frame isn't supported here)
+        """
+        self.__start_step()
+        gamestate = None
+        while gamestate is None:
+            start = time.perf_counter() if self.time_frames else 0
+            msg = await self.slippstream.read_message()
+            if self.time_frames:
+                self._read_time += time.perf_counter() - start
+            if msg is None and self.slippstream.writer is None:
+                return None
+            gamestate = self.handle_message(msg)
+        self.__finish_step()
+        return gamestate
 
+    def handle_message(self, msg):
+        """ Apply one SlippiComm message to the frame currently being read
+
+        This is for feeding the console messages yourself (see ConsolePool),
+        instead of having step() read them. Returns the finished GameState if
+        this message completed a frame, otherwise None
+        """
+        if self._gamestate is None:
+            self._gamestate = self.__new_gamestate()
+        if self.time_frames:
+            start = time.perf_counter()
+            frame_ended = self.__handle_message(msg, self._gamestate)
+            self._parse_time += time.perf_counter() - start
+        else:
+            frame_ended = self.__handle_message(msg, self._gamestate)
+        if not frame_ended:
+            return None
+        gamestate = self._gamestate
+        self._gamestate = None
+        start = time.perf_counter() if self.time_frames else 0
         self.__fixframeindexing(gamestate)
         self.__fixiasa(gamestate)
+        if self.time_frames:
+            self.__record_latency(time.perf_counter() - start)
+        if getattr(self.slippstream, "reconnects", 0) != self._reconnects:
+            self.__note_reconnect(gamestate)
+        self._prev_gamestate = gamestate
+        return gamestate
+
+    def __read_message(self):
+        if not self.time_frames:
+            return self.slippstream.read_message()
+        start = time.perf_counter()
+        msg = self.slippstream.read_message()
+        self._read_time += time.perf_counter() - start
+        return msg
+
+    def __record_latency(self, fixups):
+        """ Log where the frame that just finished spent its time """
+        decode = 0
+        if self.slippstream is not None:
+            decode = self.slippstream.decode_time - self._decode_mark
+            self._decode_mark = self.slippstream.decode_time
+        # Reading a message includes decoding it, so take that back out
+        wait = max(0, self._read_time - decode)
+        self.latency.record(wait, decode, self._parse_time, fixups)
+        self._read_time = 0
+        self._parse_time = 0
+        if self.latency_dump_every and self.latency.count % self.latency_dump_every == 0:
+            print(self.latency.summary())
+
+    def __note_reconnect(self, gamestate):
+        """ Work out how much of the game we missed while reconnecting """
+        self._reconnects = self.slippstream.reconnects
+        self.reconnect_gap_frames = max(0, gamestate.frame - self._prev_gamestate.frame - 1)
+        self.reconnect_gap_ms = self.slippstream.reconnect_gap_ms
+        print("Reconnected to Slippi after {:.0f} ms, skipped {} frames".format(
+            self.reconnect_gap_ms, self.reconnect_gap_frames))
+
+    def __new_gamestate(self):
+        """ Returns the GameState that the next frame should be read into """
+        if not self.reuse_gamestate:
+            return GameState(self.ai_port, self.opponent_port)
+        if self._gamestate_buffers is None:
+            self._gamestate_buffers = [GameState(self.ai_port, self.opponent_port, self._ports),
+                                       GameState(self.ai_port, self.opponent_port, self._ports)]
+        # Use one that's neither the last frame we finished, nor the one the
+        #   caller is holding onto. Those are the same, unless latest_frame is
+        #   catching up several frames inside one step()
+        for gamestate in self._gamestate_buffers:
+            if gamestate is not self._prev_gamestate and gamestate is not self._returned:
+                break
+        else:
+            gamestate = GameState(self.ai_port, self.opponent_port, self._ports)
+            self._gamestate_buffers.append(gamestate)
+        gamestate.projectiles.clear()
+        return gamestate
+
+    def __start_step(self):
+        self.processingtime = time.time() - self._frametimestamp
+        self.slippstream.time_decode = self.time_frames
+        self._copied = self.slippstream.bytes_copied
+        self.frames_skipped = 0
+
+    def __finish_step(self):
+        self.bytes_copied = self.slippstream.bytes_copied - self._copied
+
+    def __skip_to_latest(self, gamestate):
+        """ Read in every complete frame that's already waiting on the socket
+
+        Returns the GameState of the newest one. Any partial frame at the end
+        is kept to be finished by the next step()
+        """
+        while self.slippstream.pending():
+            start = time.perf_counter() if self.time_frames else 0
+            messages = self.slippstream.read_available()
+            if self.time_frames:
+                self._read_time += time.perf_counter() - start
+            if messages is None:
+                break
+            for msg in messages:
+                newer = self.handle_message(msg)
+                if newer is not None:
+                    gamestate = newer
+                    self.frames_skipped += 1
         return gamestate
 
+    def __handle_message(self, msg, gamestate):
+        """ Apply one SlippiComm message to the gamestate
+
+        Returns True once the frame has ended
+        """
+        if not msg:
+            return False
+
+        if (CommType(msg['type']) == CommType.REPLAY):
+            events = msg['payload']['data']
+            frame_ended = self.__handle_slippstream_events(events, gamestate)
+            # Start the processing timer now that we're done reading messages
+            self._frametimestamp = time.time()
+            return frame_ended
+
+        # We can basically just ignore keepalives
+        elif (CommType(msg['type']) == CommType.KEEPALIVE):
+            print("Keepalive")
+
+        elif (CommType(msg['type']) == CommType.HANDSHAKE):
+            p = msg['payload']
+            print("Connected to console '{}' (Slippi Nintendont {})".format(
+                p['nick'],
+                p['nintendontVersion'],
+            ))
+        return False
+
     def __handle_slippstream_events(self, event_bytes, gamestate):
-        """ Handle a series of events, provided sequentially in a byte array """
-        lastmessage = EventType.GAME_START
-        while len(event_bytes) > 0:
-            lastmessage = EventType(event_bytes[0])
-            event_size = self.eventsize[event_bytes[0]]
-            if len(event_bytes) < event_size:
+        """ Handle a series of events, provided sequentially in a byte array
+
+        The events are walked with an offset into a single memoryview, so
+        moving on to the next event never copies the rest of the buffer.
+        Returns True once the frame has ended (FRAME_BOOKEND)
+        """
+        event_bytes = memoryview(event_bytes)
+        length = len(event_bytes)
+        offset = 0
+        eventsize = self.eventsize
+        eventhandlers = self.eventhandlers
+        while offset < length:
+            command = event_bytes[offset]
+            handler = eventhandlers[command]
+            if handler is None:
+                print("WARNING: Something went wrong unpacking events. " + \
+                    "Data is probably missing")
+                print("\tGot invalid event type: ", command)
+                return False
+            if length - offset < eventsize[command]:
                 print("WARNING: Something went wrong unpacking events. Data is probably missing")
                 print("\tDidn't have enough data for event")
                 return False
-            if (EventType(event_bytes[0]) == EventType.PAYLOADS):
-                cursor = 0x2
-                payload_size = event_bytes[1]
-                num_commands = (payload_size - 1) // 3
-                for i in range(0, num_commands):
-                    command, command_len = unpack(">bH", event_bytes[cursor:cursor+3])
-                    self.eventsize[command] = command_len+1
-                    cursor += 3
-                event_bytes = event_bytes[payload_size + 1:]
-                continue
 
-            elif (EventType(event_bytes[0]) == EventType.FRAME_START):
-                self.frame_num = unpack(">i", event_bytes[1:5])[0]
-                event_bytes = event_bytes[event_size:]
-                continue
-
-            elif (EventType(event_bytes[0]) == EventType.GAME_START):
-                event_bytes = event_bytes[event_size:]
-                continue
-
-            elif (EventType(event_bytes[0]) == EventType.GAME_END):
-                event_bytes = event_bytes[event_size:]
-                continue
-
-            elif (EventType(event_bytes[0]) == EventType.PRE_FRAME):
-                event_bytes = event_bytes[event_size:]
-                continue
-
-            elif (EventType(event_bytes[0]) == EventType.POST_FRAME):
-                gamestate.frame = unpack(">i", event_bytes[0x1:0x1+4])[0]
-                controller_port = unpack(">B", event_bytes[0x5:0x5+1])[0] + 1
-
-                gamestate.player[controller_port].x = unpack(">f", event_bytes[0xa:0xa+4])[0]
-                gamestate.player[controller_port].y = unpack(">f", event_bytes[0xe:0xe+4])[0]
-
-                gamestate.player[controller_port].character = enums.Character(unpack(">B", event_bytes[0x7:0x7+1])[0])
-                try:
-                    gamestate.player[controller_port].action = enums.Action(unpack(">H", event_bytes[0x8:0x8+2])[0])
-                except ValueError:
-                    gamestate.player[controller_port].action = enums.Action.UNKNOWN_ANIMATION
-
-                # Melee stores this in a float for no good reason. So we have to convert
-                facing_float = unpack(">f", event_bytes[0x12:0x12+4])[0]
-                gamestate.player[controller_port].facing = facing_float > 0
-
-                gamestate.player[controller_port].percent = int(unpack(">f", event_bytes[0x16:0x16+4])[0])
-                gamestate.player[controller_port].stock = unpack(">B", event_bytes[0x21:0x21+1])[0]
-                gamestate.player[controller_port].action_frame = int(unpack(">f", event_bytes[0x22:0x22+4])[0])
-
-                # Extract the bit at mask 0x20
-                bitflags2 = unpack(">B", event_bytes[0x27:0x27+1])[0]
-                gamestate.player[controller_port].hitlag = bool(bitflags2 & 0x20)
-
-                gamestate.player[controller_port].hitstun_frames_left = int(unpack(">f", event_bytes[0x2b:0x2b+4])[0])
-                gamestate.player[controller_port].on_ground = not bool(unpack(">B", event_bytes[0x2f:0x2f+1])[0])
-                gamestate.player[controller_port].jumps_left = unpack(">B", event_bytes[0x32:0x32+1])[0]
+            if self.time_events:
+                start = time.perf_counter()
+                frame_ended = handler(event_bytes, offset, gamestate)
+                self.eventtime[command] += time.perf_counter() - start
+                self.eventcount[command] += 1
+            else:
+                frame_ended = handler(event_bytes, offset, gamestate)
 
-                event_bytes = event_bytes[event_size:]
-                continue
+            # Read the size after handling, since PAYLOADS sets its own
+            offset += eventsize[command]
+            if frame_ended:
+                return True
 
-            elif (EventType(event_bytes[0]) == EventType.GECKO_CODES):
-                event_bytes = event_bytes[event_size:]
-                continue
+        return False
 
-            elif (EventType(event_bytes[0]) == EventType.FRAME_BOOKEND):
-                event_bytes = event_bytes[event_size:]
-                return True
+    def eventtimings(self):
+        """ Returns a dict of EventType (or command byte, for event types we don't know)
+        to a tuple of (events handled, total seconds spent handling them)
 
-            elif (EventType(event_bytes[0]) == EventType.ITEM_UPDATE):
-                # TODO projectiles
-                projectile = Projectile()
-                projectile.x = unpack(">f", event_bytes[0x14:0x14+4])[0]
-                projectile.y = unpack(">f", event_bytes[0x18:0x18+4])[0]
-                projectile.x_speed = unpack(">f", event_bytes[0x0c:0x0c+4])[0]
-                projectile.y_speed = unpack(">f", event_bytes[0x10:0x10+4])[0]
+        Only counted while time_events is True
+        """
+        timings = dict()
+        for command, count in enumerate(self.eventcount):
+            if count:
                 try:
-                    projectile.subtype = enums.ProjectileSubtype(unpack(">H", event_bytes[0x05:0x05+2])[0])
+                    eventtype = EventType(command)
                 except ValueError:
-                    projectile.subtype = enums.UNKNOWN_PROJECTILE
-                # Add the projectile to the gamestate list
-                gamestate.projectiles.append(projectile)
-
-                event_bytes = event_bytes[event_size:]
-                continue
-
-            else:
-                print("WARNING: Something went wrong unpacking events. " + \
-                    "Data is probably missing")
-                print("\tGot invalid event type: ", event_bytes[0])
-                return False
+                    eventtype = command
+                timings[eventtype] = (count, self.eventtime[command])
+        return timings
+
+    def __handle_payloads(self, event_bytes, offset, gamestate):
+        """ The sizes of every other event. Sets up the dispatch table for them """
+        cursor = offset + 0x2
+        payload_size = event_bytes[offset + 1]
+        self.eventsize[EventType.PAYLOADS.value] = payload_size + 1
+        num_commands = (payload_size - 1) // 3
+        for i in range(0, num_commands):
+            command, command_len = unpack_from(">BH", event_bytes, cursor)
+            self.eventsize[command] = command_len+1
+            self.eventhandlers[command] = self.__event_handler(command)
+            cursor += 3
+        self.__compile_layouts()
+
+    def __event_handler(self, command):
+        """ Returns the bound handler for the given command byte """
+        handlers = {
+            EventType.PAYLOADS.value: self.__handle_payloads,
+            EventType.GAME_START.value: self.__handle_game_start,
+            EventType.FRAME_START.value: self.__handle_frame_start,
+            EventType.PRE_FRAME.value: self.__handle_pre_frame,
+            EventType.POST_FRAME.value: self.__handle_post_frame,
+            EventType.ITEM_UPDATE.value: self.__handle_item_update,
+            EventType.FRAME_BOOKEND.value: self.__handle_frame_bookend,
+        }
+        # Everything else (GECKO_CODES, GAME_END, ...) is skipped over
+        return handlers.get(command, self.__skip_event)
+
+    def __skip_event(self, event_bytes, offset, gamestate):
+        pass
 
-        return False
+    def __handle_game_start(self, event_bytes, offset, gamestate):
+        """ Note down which ports are in the game """
+        ports = []
+        for i in range(4):
+            # Player type 3 is an empty port
+            if event_bytes[offset + 0x66 + (0x24 * i)] != 3:
+                ports.append(i + 1)
+        self._ports = ports
+        # Reused gamestates need to be rebuilt with the new set of players
+        self._gamestate_buffers = None
+
+    def __handle_frame_start(self, event_bytes, offset, gamestate):
+        self.frame_num = unpack_from(">i", event_bytes, offset + 1)[0]
+
+    def __handle_pre_frame(self, event_bytes, offset, gamestate):
+        values = self._pre_frame_layout.unpack_from(event_bytes, offset)
+        # Nana's inputs are made up by the game, the controller is Popo's
+        if values[eventlayout.PRE_FRAME_FOLLOWER]:
+            return
+        controller_port = values[eventlayout.PRE_FRAME_PORT] + 1
+        player = gamestate.player.get(controller_port)
+        if player is None:
+            player = gamestate.player[controller_port] = PlayerState()
+        self._pre_frame_layout.apply(player.inputs, values)
+
+    def __handle_post_frame(self, event_bytes, offset, gamestate):
+        frame, port = eventlayout.POST_FRAME_HEADER.unpack_from(event_bytes, offset + 1)
+        gamestate.frame = frame
+        controller_port = port + 1
+        player = gamestate.player.get(controller_port)
+        if player is None:
+            # Only when a new game starts partway through reading a reused gamestate
+            player = gamestate.player[controller_port] = PlayerState()
+        # The rest gets decoded when it's read. (The buffer gets reused, so copy it)
+        player.set_post_frame(bytes(event_bytes[offset:offset + self._post_frame_size]))
+
+    def __handle_item_update(self, event_bytes, offset, gamestate):
+        # TODO projectiles
+        projectile = Projectile()
+        values = self._item_update_layout.unpack_from(event_bytes, offset)
+        self._item_update_layout.apply(projectile, values)
+        # Add the projectile to the gamestate list
+        gamestate.projectiles.append(projectile)
+
+    def __handle_frame_bookend(self, event_bytes, offset, gamestate):
+        return True
+
+    def __compile_layouts(self):
+        """ (Re)build the event decoders for the event sizes we've been told about """
+        self._pre_frame_layout = eventlayout.EventLayout(eventlayout.PRE_FRAME_FIELDS,
+                                                         self.eventsize[EventType.PRE_FRAME.value])
+        self._post_frame_size = self.eventsize[EventType.POST_FRAME.value]
+        self._item_update_layout = eventlayout.EventLayout(eventlayout.ITEM_UPDATE_FIELDS,
+                                                           self.eventsize[EventType.ITEM_UPDATE.value])
 
     def get_dolphin_home_path(self):
         """Return the path to dolphin's home directory"""
@@ -389,14 +620,26 @@ class Console:
     # Melee's indexing of action frames is wildly inconsistent.
     #   Here we adjust all of the frames to be indexed at 1 (so math is easier)
     def __fixframeindexing(self, gamestate):
-        for _, player in gamestate.player.items():
-            if player.action.value in self.zero_indices[player.character.value]:
+        zero_index = self.zero_index
+        width = self.zero_index_width
+        players = gamestate.player
+        # Only the ports that are in the game. (Everyone else has no action)
+        for port in self._ports:
+            player = players.get(port)
+            if player is None:
+                continue
+            action = player.action.value
+            if action < width and zero_index[player.character.value * width + action]:
                 player.action_frame = player.action_frame + 1
 
     # The IASA flag doesn't set or reset for special attacks.
     #   So let's just set IASA to False for all non-A attacks.
     def __fixiasa(self, gamestate):
-        for index, player in gamestate.player.items():
+        players = gamestate.player
+        for port in self._ports:
+            player = players.get(port)
+            if player is None:
+                continue
             # Luckily for us, all the A-attacks are in a contiguous place in the enums!
             #   So we don't need to call them out one by one
             if player.action.value < Action.NEUTRAL_ATTACK_1.value or player.action.value > Action.DAIR.value:
@@ -0,0 +1,97 @@
+""" Drive several Slippi consoles (ie: many dolphin instances) from one process
+
+Each Console on its own blocks inside step() until its next frame arrives. The
+ConsolePool instead waits on all of their sockets at once (with epoll/kqueue/etc
+through the selectors module) and hands back every console that has a completed
+frame, so one process can run lots of games and batch up work across them.
+
+The pool never reconnects a console, even one with reconnect on, since that
+would hold up all the others. A console whose connection drops just stops
+being read.
+"""
+
+import selectors
+from collections import deque
+
+class ConsolePool:
+    def __init__(self, consoles=()):
+        """ consoles: Console objects to drive. Set up their slippi_address and
+            slippi_port before calling connect()
+        """
+        self.selector = selectors.DefaultSelector()
+        self.consoles = list(consoles)
+        # Frames that have been read but not handed out yet, per console
+        self._frames = {console: deque() for console in self.consoles}
+
+    def add(self, console):
+        """ Add another console to the pool. If it's already connected, start reading it """
+        if console not in self._frames:
+            self.consoles.append(console)
+            self._frames[console] = deque()
+        if getattr(console, "slippstream", None) and console.slippstream.server is not None:
+            self.__register(console)
+
+    def connect(self):
+        """ Connect to every console in the pool
+
+        Returns boolean of success (for all of them)
+        """
+        success = True
+        for console in self.consoles:
+            if not console.connect():
+                print("ERROR: Failed to connect to console at {}:{}".format(
+                    console.slippi_address, console.slippi_port))
+                success = False
+                continue
+            self.__register(console)
+        return success
+
+    def step(self, timeout=None):
+        """ Wait until at least one console has a completed frame
+
+        Returns a list of (console, gamestate) tuples, with at most one frame per
+        console. Frames are handed out in order, so a console that got ahead will
+        have its next frame ready right away on the following call.
+        Returns an empty list if the timeout (in seconds) ran out first, or if
+        there are no connected consoles left.
+        """
+        while True:
+            ready = [(console, frames.popleft()) for console, frames in self._frames.items() if frames]
+            if ready:
+                return ready
+            if not self.selector.get_map():
+                return []
+
+            events = self.selector.select(timeout)
+            if not events:
+                return []
+            for key, _ in events:
+                self.__read(key.data)
+
+    def stop(self):
+        """ Disconnect from (and stop) every console in the pool """
+        for console in self.consoles:
+            self.__unregister(console)
+            console.stop()
+
+    def __read(self, console):
+        """ Read whatever a console has sent us, and queue up any frames it completed """
+        messages = console.slippstream.read_available()
+        if messages is None:
+            # The connection is gone. Stop waiting on it
+            self.__unregister(console)
+            return
+        for msg in messages:
+            gamestate = console.handle_message(msg)
+            if gamestate is not None:
+                self._frames[console].append(gamestate)
+
+    def __register(self, console):
+        server = console.slippstream.server
+        server.setblocking(False)
+        self.selector.register(server, selectors.EVENT_READ, console)
+
+    def __unregister(self, console):
+        for key in list(self.selector.get_map().values()):
+            if key.data is console:
+                self.selector.unregister(key.fileobj)
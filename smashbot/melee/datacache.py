@@ -0,0 +1,123 @@
+""" Cached loading of libmelee's data tables (actiondata.csv, characterdata.csv)
+
+Parsing the CSVs is a noticeable part of starting up a Console or FrameData, and
+every process used to do it from scratch. Instead, each table is parsed once into
+its final form and pickled into CACHE_DIR, along with the CSV's mtime, size and
+hash. Later loads use the pickle as long as the CSV hasn't changed (checking the
+hash only if the mtime or size did), and within a process each table is only
+loaded once.
+
+The tables handed out are shared, so treat them as read-only.
+"""
+
+import csv
+import hashlib
+import os
+import pickle
+import tempfile
+
+from melee import enums
+
+# Bump this whenever what a parser produces changes, to ignore old caches
+CACHE_VERSION = 1
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "libmelee")
+DATA_DIR = os.path.dirname(os.path.realpath(__file__))
+
+# Tables that have already been loaded in this process, by CSV name
+_loaded = {}
+
+def zero_index_table():
+    """ Returns (width, table) of which actions have zero-indexed frame counts
+
+    table is a dense bytes of flags, indexed by character * width + action.
+    Actions of width or more are never zero-indexed
+    """
+    return _load("actiondata.csv", _parse_actiondata)
+
+def character_data():
+    """ Returns a dict of Character to a dict of that character's attributes
+    (Gravity, Friction, etc.) from characterdata.csv, as floats
+    """
+    return _load("characterdata.csv", _parse_characterdata)
+
+def _parse_actiondata(csvfile):
+    actiondata = list(csv.DictReader(csvfile))
+    width = max(int(line["action"]) for line in actiondata) + 1
+    table = bytearray(0x100 * width)
+    for line in actiondata:
+        if line["zeroindex"] == "True":
+            table[int(line["character"]) * width + int(line["action"])] = 1
+    return width, bytes(table)
+
+def _parse_characterdata(csvfile):
+    characterdata = dict()
+    for line in csv.DictReader(csvfile):
+        del line["Character"]
+        #Convert all fields to numbers
+        for key, value in line.items():
+            line[key] = float(value)
+        characterdata[enums.Character(line["CharacterIndex"])] = line
+    return characterdata
+
+def _load(name, parse):
+    """ Load a parsed table, from this process, the on-disk cache, or the CSV """
+    if name in _loaded:
+        return _loaded[name]
+
+    csv_path = os.path.join(DATA_DIR, name)
+    # (Different copies of libmelee get caches of their own)
+    copy = hashlib.sha1(csv_path.encode()).hexdigest()[:12]
+    cache_path = os.path.join(CACHE_DIR, "{}.{}.v{}.pickle".format(name, copy, CACHE_VERSION))
+    stat = os.stat(csv_path)
+    cached = _read_cache(cache_path)
+
+    data = None
+    # Whether the cache file needs (re)writing
+    stale = True
+    if cached is not None:
+        if (cached["mtime"], cached["size"]) == (stat.st_mtime_ns, stat.st_size):
+            data = cached["data"]
+            stale = False
+        elif cached["hash"] == _hash(csv_path):
+            # Touched, but not changed (ie: a fresh checkout). Just note the new mtime
+            data = cached["data"]
+
+    if data is None:
+        with open(csv_path) as csvfile:
+            data = parse(csvfile)
+    if stale:
+        _write_cache(cache_path, {
+            "mtime": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "hash": _hash(csv_path),
+            "data": data,
+        })
+
+    _loaded[name] = data
+    return data
+
+def _hash(path):
+    with open(path, "rb") as csvfile:
+        return hashlib.sha256(csvfile.read()).hexdigest()
+
+def _read_cache(cache_path):
+    """ Returns the cache file's contents, or None if it's missing or unreadable """
+    try:
+        with open(cache_path, "rb") as cachefile:
+            cached = pickle.load(cachefile)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None
+    if not isinstance(cached, dict) or not {"mtime", "size", "hash", "data"} <= cached.keys():
+        return None
+    return cached
+
+def _write_cache(cache_path, contents):
+    """ Write the cache out atomically, so other processes never see half of it """
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path))
+        with os.fdopen(fd, "wb") as cachefile:
+            pickle.dump(contents, cachefile, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        print("WARNING: Could not write the data cache:", e)
@@ -0,0 +1,204 @@
+""" Binary layouts of the Slippi replay events that Console decodes
+
+Each event type's fields are declared once, as a table of
+    (offset, struct format, target attribute, converter)
+and compiled into a single struct.Struct, so that a whole event is decoded
+with one unpack_from() call.
+
+Offsets count the leading command byte, just like the Slippi spec does.
+Fields without a target attribute are not copied onto the target object,
+they're there for the event handler to pick out of the unpacked values by index.
+
+POST_FRAME is different: it has lots of fields and most bots only read a few of
+them. So PlayerState just keeps the raw event around, and add_lazy_fields()
+turns its POST_FRAME attributes into LazyFields that decode themselves from it
+the first time they're read.
+"""
+
+from struct import Struct, calcsize
+
+from melee import enums
+
+# Enum construction is slow, so look values up in plain dicts instead
+_ACTIONS = {action.value: action for action in enums.Action}
+_CHARACTERS = {character.value: character for character in enums.Character}
+_SUBTYPES = {subtype.value: subtype for subtype in enums.ProjectileSubtype}
+
+def _action(value):
+    return _ACTIONS.get(value, enums.Action.UNKNOWN_ANIMATION)
+
+def _character(value):
+    return _CHARACTERS.get(value, enums.Character.UNKNOWN_CHARACTER)
+
+def _subtype(value):
+    return _SUBTYPES.get(value, enums.ProjectileSubtype.UNKNOWN_PROJECTILE)
+
+def _facing(value):
+    # Melee stores this in a float for no good reason. So we have to convert
+    return value > 0
+
+def _hitlag(bitflags2):
+    # Extract the bit at mask 0x20
+    return bool(bitflags2 & 0x20)
+
+def _on_ground(airborne):
+    return not airborne
+
+def _invulnerable(hurtbox_state):
+    # 0 is vulnerable, 1 invulnerable, 2 intangible
+    return hurtbox_state != 0
+
+def _stick(value):
+    # Slippi has sticks from -1 to 1, but we have them from 0 to 1
+    return (value + 1) / 2
+
+# PRE_FRAME: What a player's controller was doing at the start of a frame
+PRE_FRAME_PORT = 0
+PRE_FRAME_FOLLOWER = 1
+PRE_FRAME_FIELDS = (
+    (0x05, "B", None, None),
+    (0x06, "B", None, None),
+    (0x19, "f", "main_stick_x", _stick),
+    (0x1d, "f", "main_stick_y", _stick),
+    (0x21, "f", "c_stick_x", _stick),
+    (0x25, "f", "c_stick_y", _stick),
+    (0x29, "f", "trigger", None),
+    (0x2d, "I", "buttons", None),
+    (0x31, "H", "buttons_physical", None),
+    (0x33, "f", "l_shoulder", None),
+    (0x37, "f", "r_shoulder", None),
+)
+
+# POST_FRAME: The state of one player at the end of a frame
+#   The frame and port are read straight away, everything else lazily
+POST_FRAME_HEADER = Struct(">iB")
+POST_FRAME_FIELDS = (
+    (0x07, "B", "character", _character),
+    (0x08, "H", "action", _action),
+    (0x0a, "f", "x", None),
+    (0x0e, "f", "y", None),
+    (0x12, "f", "facing", _facing),
+    (0x16, "f", "percent", int),
+    (0x1a, "f", "shield_strength", None),
+    (0x1e, "B", "last_attack_landed", None),
+    (0x1f, "B", "combo_count", None),
+    (0x21, "B", "stock", None),
+    (0x22, "f", "action_frame", int),
+    (0x27, "B", "hitlag", _hitlag),
+    (0x2b, "f", "hitstun_frames_left", int),
+    (0x2f, "B", "on_ground", _on_ground),
+    (0x32, "B", "jumps_left", None),
+    # Added in Slippi 2.0.0
+    (0x34, "B", "invulnerable", _invulnerable),
+    # Added in Slippi 3.5.0
+    (0x35, "f", "speed_air_x_self", None),
+    (0x39, "f", "speed_y_self", None),
+    (0x3d, "f", "speed_x_attack", None),
+    (0x41, "f", "speed_y_attack", None),
+    (0x45, "f", "speed_ground_x_self", None),
+    # Added in Slippi 3.8.0
+    (0x49, "f", "hitlag_left", int),
+)
+
+def lazy_slots(fields):
+    """ The __slots__ a class needs to hold the given fields with add_lazy_fields() """
+    return tuple("_" + attribute for _, _, attribute, _ in fields if attribute is not None)
+
+def add_lazy_fields(cls, fields):
+    """ Replace the given fields' attributes on a class with LazyFields
+
+    The class needs the lazy_slots() of the fields in its __slots__, plus _raw
+    (the event bytes, or None) and _decoded (a bitmask of the fields that have
+    been decoded from those bytes so far). Set _raw and zero _decoded to hand
+    it a new event.
+    """
+    for bit, (offset, fmt, attribute, converter) in enumerate(f for f in fields if f[2] is not None):
+        setattr(cls, attribute, LazyField(getattr(cls, "_" + attribute), 1 << bit, offset, fmt, converter))
+
+class LazyField:
+    """ An attribute that's decoded from a raw event the first time it's read
+
+    The value lives in a slot of its own (the attribute's name with an underscore
+    in front), which also holds its default if the event is too old to have it.
+    Setting the attribute works as normal, and overrides the event's value
+    """
+    __slots__ = ('slot', 'bit', 'offset', 'end', 'unpack_from', 'converter')
+
+    def __init__(self, slot, bit, offset, fmt, converter):
+        self.slot = slot
+        self.bit = bit
+        self.offset = offset
+        self.end = offset + calcsize(">" + fmt)
+        self.unpack_from = Struct(">" + fmt).unpack_from
+        self.converter = converter
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        if not obj._decoded & self.bit:
+            obj._decoded |= self.bit
+            raw = obj._raw
+            if raw is not None and self.end <= len(raw):
+                value = self.unpack_from(raw, self.offset)[0]
+                if self.converter is not None:
+                    value = self.converter(value)
+                self.slot.__set__(obj, value)
+                return value
+        return self.slot.__get__(obj)
+
+    def __set__(self, obj, value):
+        self.slot.__set__(obj, value)
+        obj._decoded |= self.bit
+
+# ITEM_UPDATE: The state of one item (projectile) this frame
+ITEM_UPDATE_FIELDS = (
+    (0x05, "H", "subtype", _subtype),
+    (0x0c, "f", "x_speed", None),
+    (0x10, "f", "y_speed", None),
+    (0x14, "f", "x", None),
+    (0x18, "f", "y", None),
+)
+
+class EventLayout:
+    """ A table of event fields, compiled for a given event size
+
+    unpack_from(buffer, offset) unpacks all the fields of the event starting at
+    offset, and apply(target, values) copies those values onto the target object.
+
+    Fields that don't fit inside the event (because the console is running an
+    older version of Slippi) are left out, so their attributes keep their defaults.
+    """
+    def __init__(self, fields, size):
+        fields = sorted(f for f in fields if f[0] + calcsize(">" + f[1]) <= size)
+        layout = ">"
+        position = 0
+        for offset, fmt, _, _ in fields:
+            if offset > position:
+                layout += str(offset - position) + "x"
+            layout += fmt
+            position = offset + calcsize(">" + fmt)
+        self.size = size
+        self.struct = Struct(layout)
+        self.targets = tuple((index, attribute, converter) for index, (_, _, attribute, converter)
+                             in enumerate(fields) if attribute is not None)
+        self.unpack_from = self.struct.unpack_from
+        self.apply = _compile_apply(self.targets)
+
+def _compile_apply(targets):
+    """ Build a function that copies unpacked values onto a target object's attributes
+
+    A generic loop over the targets with setattr() costs more than the unpacking
+    saves, so we write out the assignments (the same way namedtuple does)
+    """
+    namespace = {}
+    lines = ["def apply(target, values):"]
+    for index, attribute, converter in targets:
+        if converter is None:
+            lines.append("    target.{} = values[{}]".format(attribute, index))
+        else:
+            namespace["convert_" + attribute] = converter
+            lines.append("    target.{0} = convert_{0}(values[{1}])".format(attribute, index))
+    if not targets:
+        lines.append("    pass")
+    exec("\n".join(lines), namespace)
+    return namespace["apply"]
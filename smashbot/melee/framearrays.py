@@ -0,0 +1,261 @@
+""" framedata.csv as compact NumPy arrays, that worker processes can share
+
+FrameData keeps the frame data in nested dicts, which costs every process that
+builds one tens of MB. FrameDataArrays holds the same data as one structured
+array of rows, sorted by (character, action, frame), plus an index of where each
+(character, action) starts and stops in it. Both live in a single flat buffer,
+so they can be put in shared memory (or a file) once, and then attached to by
+any number of processes without copying:
+
+    # In the parent
+    arrays = FrameDataArrays.from_csv().share()
+    # In each worker
+    arrays = FrameDataArrays.attach(name)
+
+or, with a file that every process maps in read-only:
+
+    FrameDataArrays.from_csv().save("framedata.bin")
+    arrays = FrameDataArrays.load("framedata.bin")
+
+Attached and loaded arrays are read-only.
+
+ArrayFrameData answers all of FrameData's queries straight from these arrays,
+so workers don't need FrameData's dicts at all:
+
+    framedata = ArrayFrameData(FrameDataArrays.attach(name))
+"""
+
+import csv
+import mmap
+import os
+import struct
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from melee import datacache, stages
+from melee.enums import Action
+from melee.framedata import ActionSummary, FrameData, _djtable
+
+FRAME_DTYPE = np.dtype(
+    [("character", "u1"), ("action", "u2"), ("frame", "i2")] +
+    [(field.format(i), kind) for i in range(1, 5) for field, kind in (
+        ("hitbox_{}_status", "?"), ("hitbox_{}_size", "f8"),
+        ("hitbox_{}_x", "f8"), ("hitbox_{}_y", "f8"))] +
+    [("locomotion_x", "f8"), ("locomotion_y", "f8"),
+     ("iasa", "?"), ("facing_changed", "?"), ("projectile", "?")])
+
+# The flat buffer is this header, then the rows, then the index
+#   (magic, version, rows, characters, actions)
+_HEADER = struct.Struct("<8sIQII")
+_MAGIC = b"MELEEFD\x00"
+_VERSION = 1
+# Where the rows start, after the header
+_DATA_OFFSET = 32
+INDEX_DTYPE = np.dtype("<i4")
+
+# Names of the shared memory blocks this process created
+_created = set()
+
+class FrameDataArrays:
+    def __init__(self, frames, index, buffer=None):
+        """ Use from_csv(), attach() or load() rather than making these directly
+
+        frames: Structured array of FRAME_DTYPE rows, sorted by (character, action, frame)
+        index: Array of shape (characters, actions, 2) with the [start, stop)
+            rows of each (character, action) in frames
+        buffer: Whatever owns the memory frames and index are views of
+        """
+        self.frames = frames
+        self.index = index
+        self._buffer = buffer
+
+    @classmethod
+    def from_csv(cls, path=None):
+        """ Read framedata.csv (by default, the one that comes with libmelee) """
+        if path is None:
+            path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "framedata.csv")
+        rows = dict()
+        with open(path) as csvfile:
+            for frame in csv.DictReader(csvfile):
+                key = (int(frame["character"]), int(frame["action"]), int(frame["frame"]))
+                # Later rows win, just like they do in FrameData's dicts
+                rows[key] = key + tuple(
+                    frame[name] == "True" if FRAME_DTYPE[name] == np.bool_ else float(frame[name])
+                    for name in FRAME_DTYPE.names[3:])
+        frames = np.array(sorted(rows.values()), dtype=FRAME_DTYPE)
+
+        characters = int(frames["character"].max()) + 1 if len(frames) else 0
+        actions = int(frames["action"].max()) + 1 if len(frames) else 0
+        index = np.zeros((characters, actions, 2), dtype=INDEX_DTYPE)
+        keys = frames["character"].astype(np.int64) * actions + frames["action"]
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(frames) else []
+        stops = np.r_[starts[1:], len(frames)] if len(frames) else []
+        for start, stop in zip(starts, stops):
+            index[frames["character"][start], frames["action"][start]] = (start, stop)
+        return cls(frames, index)
+
+    @property
+    def nbytes(self):
+        """ How big the flat buffer of these arrays is """
+        return _DATA_OFFSET + self.frames.nbytes + self.index.nbytes
+
+    def rows(self, character, action):
+        """ The rows of the given (int) character and action, as a view. Empty if
+        there's no frame data for it
+        """
+        if character < self.index.shape[0] and action < self.index.shape[1]:
+            start, stop = self.index[character, action]
+            return self.frames[start:stop]
+        return self.frames[0:0]
+
+    def share(self, name=None):
+        """ Copy these arrays into a new block of shared memory
+
+        Returns FrameDataArrays backed by it. Give its name to attach() in other
+        processes. The creator should unlink() it once everyone is done
+        """
+        block = shared_memory.SharedMemory(name=name, create=True, size=self.nbytes)
+        _created.add(block.name)
+        self.__write(block.buf)
+        return FrameDataArrays._from_buffer(block.buf, block)
+
+    @classmethod
+    def attach(cls, name):
+        """ Attach to arrays that another process share()d, without copying them """
+        block = shared_memory.SharedMemory(name=name)
+        # Otherwise this process would delete the block when it exits, out from
+        #   under everyone else. Only the creator should
+        if block.name not in _created:
+            resource_tracker.unregister(block._name, "shared_memory")
+        return cls._from_buffer(block.buf, block, readonly=True)
+
+    @property
+    def name(self):
+        """ The name of the shared memory these arrays live in, or None """
+        if isinstance(self._buffer, shared_memory.SharedMemory):
+            return self._buffer.name
+        return None
+
+    def save(self, path):
+        """ Write these arrays out to a file, for load() to map in """
+        buffer = bytearray(self.nbytes)
+        self.__write(memoryview(buffer))
+        with open(path, "wb") as arrayfile:
+            arrayfile.write(buffer)
+
+    @classmethod
+    def load(cls, path):
+        """ Map in arrays that were save()d to a file, without copying them """
+        with open(path, "rb") as arrayfile:
+            mapped = mmap.mmap(arrayfile.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls._from_buffer(mapped, mapped, readonly=True)
+
+    def close(self):
+        """ Let go of the shared memory or file these arrays live in. The arrays
+        (and anything sliced out of them) can't be used after this
+        """
+        buffer, self._buffer = self._buffer, None
+        self.frames = self.index = None
+        if buffer is not None:
+            buffer.close()
+
+    def unlink(self):
+        """ Delete the shared memory block (for the process that share()d it) """
+        if isinstance(self._buffer, shared_memory.SharedMemory):
+            self._buffer.unlink()
+            _created.discard(self._buffer.name)
+
+    def __write(self, buffer):
+        characters, actions, _ = self.index.shape
+        _HEADER.pack_into(buffer, 0, _MAGIC, _VERSION, len(self.frames), characters, actions)
+        end = _DATA_OFFSET + self.frames.nbytes
+        buffer[_DATA_OFFSET:end] = self.frames.tobytes()
+        buffer[end:end + self.index.nbytes] = self.index.astype(INDEX_DTYPE).tobytes()
+
+    @classmethod
+    def _from_buffer(cls, buffer, owner, readonly=False):
+        magic, version, rows, characters, actions = _HEADER.unpack_from(buffer, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError("Not a FrameDataArrays buffer (or a different version of one)")
+        frames = np.frombuffer(buffer, dtype=FRAME_DTYPE, count=rows, offset=_DATA_OFFSET)
+        index = np.frombuffer(buffer, dtype=INDEX_DTYPE, count=characters * actions * 2,
+                              offset=_DATA_OFFSET + frames.nbytes)
+        index = index.reshape((characters, actions, 2))
+        if readonly:
+            frames.flags.writeable = False
+            index.flags.writeable = False
+        return cls(frames, index, owner)
+
+
+class ArrayFrameData(FrameData):
+    """ A FrameData that answers queries from FrameDataArrays, rather than from
+    nested dicts. The per-action queries (isattack(), iasa(), getrange_forward()
+    and so on) go through FrameData's, off an ActionSummary that's built from
+    the rows of each (character, action) the first time it's asked about. So
+    they're O(1) lookups from then on, just like FrameData's
+
+    Can't record frame data. Use FrameData(write=True) for that
+    """
+    def __init__(self, arrays=None):
+        """ arrays: FrameDataArrays to use (by default, read from framedata.csv) """
+        if arrays is None:
+            arrays = FrameDataArrays.from_csv()
+        self.arrays = arrays
+        # Indexing nested lists is a lot quicker than indexing the array, for one item
+        self._spans = arrays.index.tolist()
+        self._frame = arrays.frames["frame"]
+        self._inrange_tables = {}
+        # ActionSummaries, built the first time each action is asked about
+        self.summaries = {}
+        self.characterdata = datacache.character_data()
+        self.djtable = _djtable(self.characterdata)
+
+    def _span(self, character, action):
+        """ The [start, stop) rows of the given character and action """
+        spans = self._spans
+        character, action = character.value, action.value
+        if character < len(spans) and action < len(spans[character]):
+            return spans[character][action]
+        return 0, 0
+
+    def _after(self, start, stop, action_frame):
+        """ The first row in [start, stop) that's after action_frame """
+        return start + int(self._frame[start:stop].searchsorted(action_frame, side="right"))
+
+    def summary(self, character, action):
+        summary = self.summaries.get((character, action))
+        if summary is None:
+            start, stop = self._span(character, action)
+            names = FRAME_DTYPE.names[3:]
+            frames = {row[2]: dict(zip(names, row[3:]))
+                      for row in self.arrays.frames[start:stop].tolist()}
+            summary = self.summaries[(character, action)] = ActionSummary(frames)
+        return summary
+
+    def getframe(self, character, action, action_frame):
+        start, stop = self._span(character, action)
+        row = self._after(start, stop, action_frame) - 1
+        if row >= start and self._frame[row] == action_frame:
+            return dict(zip(FRAME_DTYPE.names[3:], self.arrays.frames[row].item()[3:]))
+        return None
+
+    def endrollposition(self, character_state, stage):
+        start, stop = self._span(character_state.character, character_state.action)
+        after = self._after(start, stop, character_state.action_frame)
+        # No frame data for where we are, so assume this animation doesn't go anywhere
+        if after == start or self._frame[after - 1] != character_state.action_frame:
+            return character_state.x
+        distance = float(self.arrays.frames["locomotion_x"][after:stop].sum())
+
+        facingchanged = bool(self.arrays.frames["facing_changed"][after - 1])
+        backroll = character_state.action in [Action.ROLL_BACKWARD, Action.GROUND_ROLL_BACKWARD_UP, \
+            Action.GROUND_ROLL_BACKWARD_DOWN, Action.BACKWARD_TECH]
+        if not (character_state.facing ^ facingchanged ^ backroll):
+            distance = -distance
+
+        position = character_state.x + distance
+        if character_state.action not in [Action.TECH_MISS_UP, Action.TECH_MISS_DOWN]:
+            position = min(position, stages.edgegroundposition(stage))
+            position = max(position, -stages.edgegroundposition(stage))
+        return position
@@ -2,10 +2,152 @@ import csv
 import os
 import math
 from melee.enums import Action, Character, AttackState
-from melee import stages
+from melee import stages, datacache
 from itertools import filterfalse
 from collections import defaultdict
 
+def _running_total(start, steps):
+    """ start, then start plus each of steps (along the last axis) in turn """
+    import numpy as np
+    totals = np.empty(steps.shape[:-1] + (steps.shape[-1] + 1,))
+    totals[..., 0] = start
+    totals[..., 1:] = steps
+    return np.cumsum(totals, axis=-1, out=totals)
+
+def _jumparc(speed, gravity):
+    """ (height, frames) of a jump that starts going up at speed, and slows down by
+    gravity every frame until it stops going up
+    """
+    if speed <= 0:
+        return 0, 0
+    # The sum of the arithmetic series speed, speed - gravity, ... while it's positive
+    frames = math.ceil(speed / gravity)
+    # (In case speed / gravity rounded across a whole number)
+    if speed - frames * gravity > 0:
+        frames += 1
+    elif speed - (frames - 1) * gravity <= 0:
+        frames -= 1
+    return frames * speed - gravity * frames * (frames - 1) / 2, frames
+
+def _slide(speed, friction, frames):
+    """ Slide for up to frames frames, slowing down by friction every frame
+
+    Returns (distance, speed at the end, whether it stopped before running out of frames)
+    """
+    # The sum of the arithmetic series speed - friction, speed - 2 * friction, ...
+    #   for as long as it stays positive
+    steps = math.floor(speed / friction)
+    # (In case that rounded across a whole number)
+    if speed - steps * friction < 0:
+        steps -= 1
+    elif speed - (steps + 1) * friction >= 0:
+        steps += 1
+    stopped = steps < frames
+    steps = min(steps, frames)
+    return steps * speed - friction * steps * (steps + 1) / 2, speed - steps * friction, stopped
+
+# Jigglypuff's double jump speed, by how many jumps she has left (1 to 5)
+_JIGGLYPUFF_DJ_SPEEDS = {1: 1.186, 2: 1.296, 3: 1.406, 4: 1.526, 5: 1.586}
+
+def _djtable(characterdata):
+    """ Everyone's double jump (height, frames), by (character, jumps left)
+
+    Jumps left goes from 1 to 5, but only matters for Jigglypuff
+    """
+    table = {}
+    for character, data in characterdata.items():
+        for jumps_left in range(1, 6):
+            speed = data["InitDJSpeed"]
+            if character == Character.JIGGLYPUFF:
+                speed = _JIGGLYPUFF_DJ_SPEEDS[jumps_left]
+            table[(character, jumps_left)] = _jumparc(speed, data["Gravity"])
+    return table
+
+class ActionSummary:
+    """ Everything FrameData's per-action queries want to know about one
+    (character, action), worked out once from its frames
+
+    is_attack: Whether a hitbox (or projectile) comes out at any point
+    first_hitbox_frame, last_hitbox_frame: First and last frames with a hitbox out
+        (-1 if it's not an attack)
+    hitbox_count: How many separate times a hitbox comes out
+    iasa: First frame that's interruptible (-1 if it's not an attack)
+    last_frame: Last frame of the action (-1 if there's no frame data for it)
+    locomotion_x, locomotion_y: Total locomotion over the whole action
+    range_forward, range_backward: Furthest reach of the hitboxes, forward and
+        backward, over the whole action
+    """
+    __slots__ = ('is_attack', 'first_hitbox_frame', 'last_hitbox_frame', 'hitbox_count', 'iasa',
+                 'last_frame', 'locomotion_x', 'locomotion_y', 'range_forward', 'range_backward',
+                 '_after', '_forward_after', '_backward_after')
+
+    def __init__(self, frames):
+        """ frames: Dict of action frame to frame dict, as in FrameData.framedata """
+        frames = {action_frame: frame for action_frame, frame in frames.items() if frame}
+        attacks = sorted(action_frame for action_frame, frame in frames.items()
+                         if frame['hitbox_1_status'] or frame['hitbox_2_status'] or
+                         frame['hitbox_3_status'] or frame['hitbox_4_status'] or frame['projectile'])
+        self.is_attack = bool(attacks)
+        self.first_hitbox_frame = attacks[0] if attacks else -1
+        self.last_hitbox_frame = attacks[-1] if attacks else -1
+        self.last_frame = max(frames) if frames else -1
+        # (Added up in frame order, so the total doesn't depend on the CSV's order)
+        self.locomotion_x = sum(frames[action_frame]["locomotion_x"] for action_frame in sorted(frames))
+        self.locomotion_y = sum(frames[action_frame]["locomotion_y"] for action_frame in sorted(frames))
+
+        # Every time we go from NOT having a hit box to having one, up the count
+        self.hitbox_count = 0
+        previous = None
+        for action_frame in attacks:
+            if action_frame >= 1 and (previous is None or action_frame != previous + 1):
+                self.hitbox_count += 1
+            if action_frame >= 1:
+                previous = action_frame
+
+        iasaframes = [action_frame for action_frame, frame in frames.items() if frame["iasa"]]
+        if not self.is_attack:
+            self.iasa = -1
+        else:
+            self.iasa = min(iasaframes) if iasaframes else self.last_frame
+
+        # The remaining range after each frame, from _after up to the last hitbox
+        self._after = min(frames, default=0) - 1
+        self._forward_after = []
+        self._backward_after = []
+        forward, backward = 0, 0
+        for action_frame in range(self.last_hitbox_frame, self._after, -1):
+            self._forward_after.append(forward)
+            self._backward_after.append(backward)
+            frame = frames.get(action_frame)
+            if frame is None:
+                continue
+            for i in range(1, 5):
+                if frame["hitbox_{}_status".format(i)]:
+                    size, x = frame["hitbox_{}_size".format(i)], frame["hitbox_{}_x".format(i)]
+                    forward = max(size + x, forward)
+                    backward = min(-size + x, backward)
+        self._forward_after.append(forward)
+        self._backward_after.append(backward)
+        self._forward_after.reverse()
+        self._backward_after.reverse()
+        self.range_forward = forward
+        self.range_backward = abs(backward)
+
+    def range_forward_after(self, frame):
+        """ The furthest forward reach of the hitboxes after the given frame """
+        if frame >= self.last_hitbox_frame:
+            return 0
+        return self._forward_after[max(frame - self._after, 0)]
+
+    def range_backward_after(self, frame):
+        """ The furthest backward reach of the hitboxes after the given frame """
+        if frame >= self.last_hitbox_frame:
+            return 0
+        return abs(self._backward_after[max(frame - self._after, 0)])
+
+# The summary of an action with no frame data
+_NO_FRAMES = ActionSummary({})
+
 class FrameData:
     def __init__(self, write=False):
         if write:
@@ -18,13 +160,15 @@ class FrameData:
                 'locomotion_x', 'locomotion_y', 'iasa', 'facing_changed', 'projectile']
             self.writer = csv.DictWriter(self.csvfile, fieldnames=fieldnames)
             self.writer.writeheader()
-            self.rows = []
+            # Recorded rows, by (character, action, frame)
+            self.rows = {}
 
             self.actionfile = open("actiondata.csv", "a")
             fieldnames = ["character", "action", "zeroindex"]
             self.actionwriter = csv.DictWriter(self.actionfile, fieldnames=fieldnames)
             self.actionwriter.writeheader()
-            self.actionrows = []
+            # Recorded action rows, by (character, action)
+            self.actionrows = {}
 
             self.prevfacing = {}
             self.prevprojectilecount = {}
@@ -64,17 +208,16 @@ class FrameData:
                     "facing_changed": frame["facing_changed"] == "True", \
                     "projectile": frame["projectile"] == "True"}
 
+        # Summarise each action up front, so that the per-action queries are just lookups
+        self.summaries = {(character, action): ActionSummary(frames) \
+            for character, actions in self.framedata.items() for action, frames in actions.items()}
+
+        # inrange_many()'s tables of frame data, by (character, actions)
+        self._inrange_tables = {}
+
         #read the character data csv
-        self.characterdata = dict()
-        path = os.path.dirname(os.path.realpath(__file__))
-        with open(path + "/characterdata.csv") as csvfile:
-            reader = csv.DictReader(csvfile)
-            for line in reader:
-                del line["Character"]
-                #Convert all fields to numbers
-                for key, value in line.items():
-                    line[key] = float(value)
-                self.characterdata[Character(line["CharacterIndex"])] = line
+        self.characterdata = datacache.character_data()
+        self.djtable = _djtable(self.characterdata)
 
     #Returns boolean on if the given action is a roll
     def isgrab(self, character, action):
@@ -138,13 +281,11 @@ class FrameData:
 
     #Returns boolean on if the given action is an attack (contains a hitbox)
     def isattack(self, character, action):
-        # For each frame...
-        for i, frame in self.framedata[character][action].items():
-            if frame:
-                if frame['hitbox_1_status'] or frame['hitbox_2_status'] or frame['hitbox_3_status'] or \
-                        frame['hitbox_4_status'] or frame['projectile']:
-                    return True
-        return False
+        return self.summary(character, action).is_attack
+
+    # Returns the ActionSummary of the given action
+    def summary(self, character, action):
+        return self.summaries.get((character, action), _NO_FRAMES)
 
     def isshield(self, action):
         out = action == Action.SHIELD \
@@ -170,13 +311,14 @@ class FrameData:
         return self.attackstate(player.character, player.action, player.action_frame)
 
     def attackstate(self, character, action, frame):
-        if not self.isattack(character, action):
+        summary = self.summary(character, action)
+        if not summary.is_attack:
             return AttackState.NOT_ATTACKING
 
-        if frame < self.firsthitboxframe(character, action):
+        if frame < summary.first_hitbox_frame:
             return AttackState.WINDUP
 
-        if frame > self.lasthitboxframe(character, action):
+        if frame > summary.last_hitbox_frame:
             return AttackState.COOLDOWN
 
         return AttackState.ATTACKING
@@ -188,22 +330,7 @@ class FrameData:
         Range "remaining" means that it won't consider hitboxes that we've already passed.
     """
     def getrange_forward(self, character, action, frame):
-        attackrange = 0
-        lastframe = self.lasthitboxframe(character, action)
-        for i in range(frame+1, lastframe+1):
-            attackingframe = self.getframe(character, action, i)
-            if attackingframe is None:
-                continue
-
-            if attackingframe['hitbox_1_status']:
-                attackrange = max(attackingframe["hitbox_1_size"] + attackingframe["hitbox_1_x"], attackrange)
-            if attackingframe['hitbox_2_status']:
-                attackrange = max(attackingframe["hitbox_2_size"] + attackingframe["hitbox_2_x"], attackrange)
-            if attackingframe['hitbox_3_status']:
-                attackrange = max(attackingframe["hitbox_3_size"] + attackingframe["hitbox_3_x"], attackrange)
-            if attackingframe['hitbox_4_status']:
-                attackrange = max(attackingframe["hitbox_4_size"] + attackingframe["hitbox_4_x"], attackrange)
-        return attackrange
+        return self.summary(character, action).range_forward_after(frame)
 
     """
     Returns the maximum remaining range of the given attack, in the backwards direction
@@ -211,22 +338,7 @@ class FrameData:
         Range "remaining" means that it won't consider hitboxes that we've already passed.
     """
     def getrange_backward(self, character, action, frame):
-        attackrange = 0
-        lastframe = self.lasthitboxframe(character, action)
-        for i in range(frame+1, lastframe+1):
-            attackingframe = self.getframe(character, action, i)
-            if attackingframe is None:
-                continue
-
-            if attackingframe['hitbox_1_status']:
-                attackrange = min(-attackingframe["hitbox_1_size"] + attackingframe["hitbox_1_x"], attackrange)
-            if attackingframe['hitbox_2_status']:
-                attackrange = min(-attackingframe["hitbox_2_size"] + attackingframe["hitbox_2_x"], attackrange)
-            if attackingframe['hitbox_3_status']:
-                attackrange = min(-attackingframe["hitbox_3_size"] + attackingframe["hitbox_3_x"], attackrange)
-            if attackingframe['hitbox_4_status']:
-                attackrange = min(-attackingframe["hitbox_4_size"] + attackingframe["hitbox_4_x"], attackrange)
-        return abs(attackrange)
+        return self.summary(character, action).range_backward_after(frame)
 
     # Returns the frame that the specified attack will hit the defender
     #   Returns 0 if it won't hit
@@ -338,6 +450,128 @@ class FrameData:
                     return i
         return 0
 
+    """
+    Like inrange(), but for a whole list of attacks at once: For each of the given
+        actions, returns the frame it would hit the defender on if the attacker
+        started it right now (from its first frame), or 0 if it won't hit.
+
+    Frame by frame, this moves the attacker and checks their hitboxes exactly
+        the way inrange() does. But it does every frame of every action in one go
+        with NumPy, over tables of the actions' frame data that are only built the
+        first time a given list of actions is asked about. (So this, unlike the
+        rest of FrameData, needs NumPy)
+    """
+    def inrange_many(self, attacker, defender, stage, actions):
+        import numpy as np
+        actions = tuple(actions)
+        table = self._inrange_tables.get((attacker.character, actions))
+        if table is None:
+            table = self.__inrange_table(attacker.character, actions)
+            self._inrange_tables[(attacker.character, actions)] = table
+        free, freecount = table["free"], table["freecount"]
+        width = free.shape[1]
+        # Nothing here has a hitbox
+        if width == 0:
+            return [0] * len(actions)
+
+        defender_size = float(self.characterdata[defender.character]["size"])
+        defender_y = defender.y + defender_size
+
+        friction = self.characterdata[attacker.character]["Friction"]
+        gravity = self.characterdata[attacker.character]["Gravity"]
+        termvelocity = self.characterdata[attacker.character]["TerminalVelocity"]
+
+        # Speeds after each number of frames without locomotion (index 0 is the start)
+        #   Sliding along the ground, slowing down by friction
+        speed_x = attacker.speed_ground_x_self if attacker.on_ground else attacker.speed_air_x_self
+        if speed_x > 0:
+            slide = np.maximum(0, _running_total(speed_x, np.full(width, -friction)))
+        else:
+            slide = np.minimum(0, _running_total(speed_x, np.full(width, friction)))
+        #   Falling, speeding up by gravity
+        fall = np.maximum(-termvelocity, _running_total(attacker.speed_y_self, np.full(width, -gravity)))
+
+        if attacker.on_ground:
+            # Landed before the first frame
+            landing = np.full(len(actions), -1)
+        else:
+            # First move everyone through the air, to find the frame they land on (if any)
+            step_x = np.where(free, speed_x, table["locomotion_x"])
+            step_y = np.where(free, fall[freecount], table["locomotion_y"])
+            # (Where they are before each frame, and after the last)
+            before_x = _running_total(attacker.x, step_x)
+            before_y = _running_total(attacker.y, step_y)
+            landed = free & (before_y[:, 1:] <= 0) & (np.abs(before_x[:, :-1]) < stages.edgegroundposition(stage))
+            landing = np.where(landed.any(axis=1), landed.argmax(axis=1), width)
+
+        # Then move them again, sliding along the ground after they've landed
+        landed = table["frames"] > landing[:, None]
+        landed_at = np.where(landing >= 0, freecount[table["actions"], np.clip(landing, 0, width - 1)], 0)
+        step_x = np.where(free, np.where(landed, slide[freecount - landed_at[:, None]], speed_x), table["locomotion_x"])
+        step_y = np.where(free, np.where(landed, 0, fall[freecount]), table["locomotion_y"])
+        # Land, by stepping down (or up) to exactly 0
+        touchdown = np.flatnonzero((landing >= 0) & (landing < width))
+        if len(touchdown):
+            step_y[touchdown, landing[touchdown]] = -before_y[touchdown, landing[touchdown]]
+        attacker_x = _running_total(attacker.x, step_x)[:, 1:]
+        attacker_y = _running_total(attacker.y, step_y)[:, 1:]
+
+        # Check every hitbox, on every frame that has any out
+        hit_action, hit_frame = table["hit_action"], table["hit_frame"]
+        hitbox_x = table["hitbox_x"] if attacker.facing else -table["hitbox_x"]
+        hitbox_x = hitbox_x + attacker_x[hit_action, hit_frame, None]
+        hitbox_y = table["hitbox_y"] + attacker_y[hit_action, hit_frame, None]
+        distance = np.sqrt((hitbox_x - defender.x)**2 + (hitbox_y - defender_y)**2)
+        hits = (distance < defender_size + table["hitbox_size"]).any(axis=1)
+
+        # The first frame each action hits on. (Frames start from 1, and the
+        #   hitbox frames are in order, so assigning them backwards leaves the first)
+        first = np.zeros(len(actions), dtype=int)
+        first[hit_action[hits][::-1]] = hit_frame[hits][::-1] + 1
+        return first.tolist()
+
+    def __inrange_table(self, character, actions):
+        """ The frame data inrange_many() needs for the given actions, as arrays of
+        (action, frame), for every frame up to the last hitbox of the longest action
+        """
+        import numpy as np
+        width = max([self.lasthitboxframe(character, action) for action in actions] + [0])
+        shape = (len(actions), width)
+        table = {
+            "present": np.zeros(shape, dtype=bool),
+            "locomotion_x": np.zeros(shape),
+            "locomotion_y": np.zeros(shape),
+            "hitbox": np.zeros(shape, dtype=bool),
+            "hitbox_x": np.zeros(shape + (4,)),
+            "hitbox_y": np.zeros(shape + (4,)),
+            "hitbox_size": np.zeros(shape + (4,)),
+        }
+        for i, action in enumerate(actions):
+            for j in range(self.lasthitboxframe(character, action)):
+                frame = self.getframe(character, action, j + 1)
+                if frame is None:
+                    continue
+                table["present"][i, j] = True
+                table["locomotion_x"][i, j] = frame["locomotion_x"]
+                table["locomotion_y"][i, j] = frame["locomotion_y"]
+                table["hitbox"][i, j] = frame['hitbox_1_status'] or frame['hitbox_2_status'] or \
+                    frame['hitbox_3_status'] or frame['hitbox_4_status']
+                for k in range(4):
+                    table["hitbox_x"][i, j, k] = frame["hitbox_{}_x".format(k + 1)]
+                    table["hitbox_y"][i, j, k] = frame["hitbox_{}_y".format(k + 1)]
+                    table["hitbox_size"][i, j, k] = frame["hitbox_{}_size".format(k + 1)]
+        # Frames without locomotion, where the attacker moves under their own speed
+        table["free"] = table["present"] & (table["locomotion_x"] == 0) & (table["locomotion_y"] == 0)
+        # How many of those there have been, by each frame
+        table["freecount"] = np.cumsum(table["free"], axis=1)
+        table["frames"] = np.arange(width)
+        table["actions"] = np.arange(len(actions))
+        # Only keep the hitboxes of frames that have any out, in (action, frame) order
+        table["hit_action"], table["hit_frame"] = np.nonzero(table.pop("hitbox"))
+        for key in ("hitbox_x", "hitbox_y", "hitbox_size"):
+            table[key] = table[key][table["hit_action"], table["hit_frame"]]
+        return table
+
     """
     Returns the height the character's double jump will take them.
         If character is in jump already, returns how heigh that one goes
@@ -353,30 +587,7 @@ class FrameData:
                     return 33.218964577
             # This isn't exact. But it's close
             return 33.218964577 * (1 - (character_state.action_frame / 60))
-
-        gravity = self.characterdata[character_state.character]["Gravity"]
-        initdjspeed = self.characterdata[character_state.character]["InitDJSpeed"]
-        if character_state.jumps_left == 0:
-            initdjspeed = character_state.speed_y_self - gravity
-
-        if character_state.character == Character.JIGGLYPUFF:
-            if character_state.jumps_left >= 5:
-                initdjspeed = 1.586
-            if character_state.jumps_left == 4:
-                initdjspeed = 1.526
-            if character_state.jumps_left == 3:
-                initdjspeed = 1.406
-            if character_state.jumps_left == 2:
-                initdjspeed = 1.296
-            if character_state.jumps_left <= 1:
-                initdjspeed = 1.186
-
-        distance = 0
-
-        while initdjspeed > 0:
-            distance += initdjspeed
-            initdjspeed -= gravity
-        return distance
+        return self.__doublejump(character_state)[0]
 
     """
     Return the number of frames it takes for the character to reach the apex of
@@ -388,29 +599,16 @@ class FrameData:
         # She can float-cancel, so she can be falling at any time during the jump
         if character_state.character == Character.PEACH:
             return 1
+        return self.__doublejump(character_state)[1]
 
-        gravity = self.characterdata[character_state.character]["Gravity"]
-        initdjspeed = self.characterdata[character_state.character]["InitDJSpeed"]
-        if character_state.jumps_left == 0:
-            initdjspeed = character_state.speed_y_self - gravity
-
-        if character_state.character == Character.JIGGLYPUFF:
-            if character_state.jumps_left >= 5:
-                initdjspeed = 1.586
-            if character_state.jumps_left == 4:
-                initdjspeed = 1.526
-            if character_state.jumps_left == 3:
-                initdjspeed = 1.406
-            if character_state.jumps_left == 2:
-                initdjspeed = 1.296
-            if character_state.jumps_left <= 1:
-                initdjspeed = 1.186
-
-        frames = 0
-        while initdjspeed > 0:
-            frames += 1
-            initdjspeed -= gravity
-        return frames
+    # Returns (height, frames to the apex) of the character's double jump
+    def __doublejump(self, character_state):
+        character = character_state.character
+        # Already jumping, so it's however fast they're going up now
+        if character_state.jumps_left == 0 and character != Character.JIGGLYPUFF:
+            gravity = self.characterdata[character]["Gravity"]
+            return _jumparc(character_state.speed_y_self - gravity, gravity)
+        return self.djtable[(character, min(max(character_state.jumps_left, 1), 5))]
 
     # Returns a frame dict for the specified frame
     def getframe(self, character, action, action_frame):
@@ -423,12 +621,7 @@ class FrameData:
     def lastrollframe(self, character, action):
         if not self.isroll(character, action):
             return -1
-        frames = []
-        for action_frame in self.framedata[character][action]:
-            frames.append(action_frame)
-        if not frames:
-            return -1
-        return max(frames)
+        return self.summary(character, action).last_frame
 
     # Returns the x coordinate that the current roll will end in
     def endrollposition(self, character_state, stage):
@@ -465,110 +658,47 @@ class FrameData:
     #Returns the first frame that a hitbox appears for a given action
     #   returns -1 if no hitboxes (not an attack action)
     def firsthitboxframe(self, character, action):
-        # Grab only the subset that have a hitbox
-        hitboxes = []
-        for action_frame, frame in self.framedata[character][action].items():
-            if frame:
-                #Does this frame have a hitbox?
-                if frame['hitbox_1_status'] or frame['hitbox_2_status'] \
-                    or frame['hitbox_3_status'] or frame['hitbox_4_status'] or \
-                        frame['projectile']:
-                    hitboxes.append(action_frame)
-        if not hitboxes:
-            return -1
-        return min(hitboxes)
+        return self.summary(character, action).first_hitbox_frame
 
     # Returns the number of hitboxes an attack has
     #   By this we mean is it a multihit attack? (Peach's down B?)
     #       or a single-hit attack? (Marth's fsmash?)
     def hitboxcount(self, character, action):
-        # Grab only the subset that have a hitbox
-
         # This math doesn't work for Samu's UP_B
         #   Because the hitboxes are contiguous
         if character == Character.SAMUS and action in [Action.SWORD_DANCE_3_MID, Action.SWORD_DANCE_3_LOW]:
             return 7
-
-        hitboxes = []
-        for action_frame, frame in self.framedata[character][action].items():
-            if frame:
-                #Does this frame have a hitbox?
-                if frame['hitbox_1_status'] or frame['hitbox_2_status'] \
-                    or frame['hitbox_3_status'] or frame['hitbox_4_status'] or \
-                        frame['projectile']:
-                    hitboxes.append(action_frame)
-        if not hitboxes:
-            return 0
-        hashitbox = False
-        count = 0
-        # Every time we go from NOT having a hit box to having one, up the count
-        for i in range(1, max(hitboxes)+1):
-            hashitbox_new = i in hitboxes
-            if hashitbox_new and not hashitbox:
-                count += 1
-            hashitbox = hashitbox_new
-        return count
+        return self.summary(character, action).hitbox_count
 
     # Returns the first frame of an attack that the character is interruptible
     #   returns -1 if not an attack
     def iasa(self, character, action):
-        if not self.isattack(character, action):
-            return -1
-        iasaframes = []
-        allframes = []
-        for action_frame, frame in self.framedata[character][action].items():
-            if frame:
-                #Does this frame have a hitbox?
-                allframes.append(action_frame)
-                if frame["iasa"]:
-                    iasaframes.append(action_frame)
-        if not iasaframes:
-            return max(allframes)
-        return min(iasaframes)
+        return self.summary(character, action).iasa
 
     #Returns the last frame that a hitbox appears for a given action
     #   returns -1 if no hitboxes (not an attack action)
     def lasthitboxframe(self, character, action):
-        # Grab only the subset that have a hitbox
-        hitboxes = []
-        for action_frame, frame in self.framedata[character][action].items():
-            if frame:
-                #Does this frame have a hitbox?
-                if frame['hitbox_1_status'] or frame['hitbox_2_status'] \
-                    or frame['hitbox_3_status'] or frame['hitbox_4_status'] or \
-                        frame['projectile']:
-                    hitboxes.append(action_frame)
-        if not hitboxes:
-            return -1
-        return max(hitboxes)
+        return self.summary(character, action).last_hitbox_frame
 
     """
     Returns the count of total frames in the given action.
     """
     def lastframe(self, character, action):
-        frames = []
-        for action_frame, frame in self.framedata[character][action].items():
-            frames.append(action_frame)
-        if not frames:
-            return -1
-        return max(frames)
+        return self.summary(character, action).last_frame
 
     #This is a helper function to remove all the non-attacking, non-rolling, non-B move actions
     def cleanupcsv(self):
         #Make a list of all the attacking action names
-        attacks = []
-        for row in self.rows:
+        attacks = set()
+        for row in self.rows.values():
             if row['hitbox_1_status'] or row['hitbox_2_status'] or \
                     row['hitbox_3_status'] or row['hitbox_4_status'] or \
                     row['projectile']:
-                attacks.append(row['action'])
-        #remove duplicates
-        attacks = list(set(attacks))
-        #Make a second pass, removing anything not in the list
-        for row in list(self.rows):
-            if row['action'] not in attacks and not self.isroll(Character(row['character']), Action(row['action'])) \
-                    and not self.isbmove(Character(row['character']), Action(row['action'])):
-                self.rows.remove(row)
+                attacks.add(row['action'])
+        #Make a second pass, keeping only what's in the list
+        self.rows = {key: row for key, row in self.rows.items() if row['action'] in attacks \
+            or self.isroll(Character(row['character']), Action(row['action'])) \
+            or self.isbmove(Character(row['character']), Action(row['action']))}
 
     def recordframe(self, gamestate):
         # First, adjust and record zero-indexing
@@ -580,15 +710,12 @@ class FrameData:
             actionrow["zeroindex"] = True
             gamestate.opponent_state.action_frame += 1
 
-        alreadythere = False
-        for i in self.actionrows:
-            if i['character'] == actionrow['character'] and i['action'] == actionrow['action']:
-                alreadythere = True
-                if actionrow["zeroindex"]:
-                    gamestate.opponent_state.action_frame += 1
-
-        if not alreadythere:
-            self.actionrows.append(actionrow)
+        actionkey = (actionrow['character'], actionrow['action'])
+        if actionkey in self.actionrows:
+            if actionrow["zeroindex"]:
+                gamestate.opponent_state.action_frame += 1
+        else:
+            self.actionrows[actionkey] = actionrow
 
         # So here's the deal... We don't want to count horizontal momentum for almost
         #   all air moves. Except a few. So let's just enumerate those. It's ugly,
@@ -599,7 +726,7 @@ class FrameData:
             Action.EDGE_JUMP_1_SLOW, Action.EDGE_JUMP_1_QUICK, Action.EDGE_JUMP_2_SLOW, Action.EDGE_JUMP_2_QUICK]
 
         if gamestate.opponent_state.on_ground or airmoves:
-            xspeed = gamestate.opponent_state.x - gamestate.opponent_state.__prev_x
+            xspeed = gamestate.opponent_state.x - gamestate.opponent_state._prev_x
 
         # This is a bit strange, but here's why:
         #   The vast majority of actions don't actually affect vertical speed
@@ -607,7 +734,7 @@ class FrameData:
         #   Any exceptions can be manually edited in
         #  However, there's plenty of attacks that make the character fly upward at a set
         #   distance, like up-b's. So keep those around
-        yspeed = max(gamestate.opponent_state.y - gamestate.opponent_state.__prev_y, 0)
+        yspeed = max(gamestate.opponent_state.y - gamestate.opponent_state._prev_y, 0)
 
         # Some actions never have locomotion. Make sure to not count it
         if gamestate.opponent_state.action in [Action.TECH_MISS_UP, Action.TECH_MISS_DOWN]:
@@ -641,11 +768,10 @@ class FrameData:
             }
 
         # Do we already have the previous frame recorded?
-        for i in self.rows:
-            if i['character'] == row['character'] and i['action'] == row['action'] and i['frame'] == row['frame']-1:
-                # If the facing changed once, always have it changed
-                if i["facing_changed"]:
-                    row["facing_changed"] = True
+        previous = self.rows.get((row['character'], row['action'], row['frame']-1))
+        # If the facing changed once, always have it changed
+        if previous is not None and previous["facing_changed"]:
+            row["facing_changed"] = True
         # If the facing changed from last frame, set the facing changed bool
         oldfacing = self.prevfacing.get(gamestate.opponent_state.action)
         if (oldfacing != None) and (oldfacing != gamestate.opponent_state.facing):
@@ -683,10 +809,7 @@ class FrameData:
                     gamestate.opponent_state.action != Action.SWORD_DANCE_3_HIGH:
                 row["projectile"] = True
 
-        alreadythere = False
-        for i in self.rows:
-            if i['character'] == row['character'] and i['action'] == row['action'] and i['frame'] == row['frame']:
-                alreadythere = True
+        rowkey = (row['character'], row['action'], row['frame'])
 
         # Kludgey changes below:
         #   Marth's neutral attack 1 technically doesn't IASA until the last two frames,
@@ -702,16 +825,16 @@ class FrameData:
         if row["character"] == Character.SAMUS.value and row["action"] == Action.NEUTRAL_B_ATTACKING.value:
             row["projectile"] = False
 
-        if not alreadythere:
-            self.rows.append(row)
+        if rowkey not in self.rows:
+            self.rows[rowkey] = row
 
         self.prevfacing[gamestate.opponent_state.action] = gamestate.opponent_state.facing
         self.prevprojectilecount[gamestate.opponent_state.action] = len(gamestate.projectiles)
 
     def saverecording(self):
         self.cleanupcsv()
-        self.writer.writerows(self.rows)
-        self.actionwriter.writerows(self.actionrows)
+        self.writer.writerows(self.rows.values())
+        self.actionwriter.writerows(self.actionrows.values())
         self.csvfile.close()
         self.actionfile.close()
 
@@ -723,32 +846,70 @@ class FrameData:
     """
     def slidedistance(self, character_state, initspeed, frames):
         normalfriction = self.characterdata[character_state.character]["Friction"]
-        friction = normalfriction
-        totaldistance = 0
         walkspeed = self.characterdata[character_state.character]["MaxWalkSpeed"]
+        frames = max(frames, 0)
         # Just the speed, not direction
         absspeed = abs(initspeed)
-        multiplier = 1
-        for i in range(frames):
-            # Special case for these two damn animations, for some reason. Thanks melee
-            if character_state.action in [Action.TECH_MISS_UP]:
-                if character_state.action_frame + i < 18:
-                    friction = .051
-                    multiplier = 1
-                else:
-                    friction = normalfriction
-            # If we're sliding faster than the character's walk speed, then
-            #   the slowdown is doubled
-            elif absspeed > walkspeed:
-                multiplier = 2
-            else:
-                multiplier = 1
 
-            absspeed -= friction * multiplier
-            if absspeed < 0:
-                break
-            totaldistance += absspeed
+        # The slide goes in two phases, each slowing down by a constant amount per frame
+        # Special case for these two damn animations, for some reason. Thanks melee
+        if character_state.action in [Action.TECH_MISS_UP]:
+            friction = .051
+            firstframes = min(max(18 - character_state.action_frame, 0), frames)
+        # If we're sliding faster than the character's walk speed, then
+        #   the slowdown is doubled (for as long as we're still faster)
+        else:
+            friction = normalfriction * 2
+            firstframes = 0
+            if absspeed > walkspeed:
+                firstframes = math.ceil((absspeed - walkspeed) / friction)
+                # (In case that rounded across a whole number)
+                if absspeed - (firstframes - 1) * friction <= walkspeed:
+                    firstframes -= 1
+                elif absspeed - firstframes * friction > walkspeed:
+                    firstframes += 1
+            firstframes = min(firstframes, frames)
+
+        totaldistance, absspeed, stopped = _slide(absspeed, friction, firstframes)
+        if not stopped:
+            totaldistance += _slide(absspeed, normalfriction, frames - firstframes)[0]
         if initspeed < 0:
             totaldistance = -totaldistance
 
         return totaldistance
+
+    """
+    slidedistance() for a whole array of initial speeds at once. Returns an array
+        of how far each would slide. (Needs NumPy)
+    """
+    def slidedistances(self, character_state, initspeeds, frames):
+        import numpy as np
+        normalfriction = self.characterdata[character_state.character]["Friction"]
+        walkspeed = self.characterdata[character_state.character]["MaxWalkSpeed"]
+        frames = max(frames, 0)
+        initspeeds = np.asarray(initspeeds, dtype=float)
+        absspeed = np.abs(initspeeds)
+
+        if character_state.action in [Action.TECH_MISS_UP]:
+            friction = .051
+            firstframes = np.full(absspeed.shape, min(max(18 - character_state.action_frame, 0), frames))
+        else:
+            friction = normalfriction * 2
+            firstframes = np.ceil((absspeed - walkspeed) / friction)
+            firstframes = np.where(absspeed - (firstframes - 1) * friction <= walkspeed, firstframes - 1, firstframes)
+            firstframes = np.where(absspeed - firstframes * friction > walkspeed, firstframes + 1, firstframes)
+            firstframes = np.clip(firstframes, 0, frames)
+
+        totaldistance = np.zeros(absspeed.shape)
+        stopped = np.zeros(absspeed.shape, dtype=bool)
+        for friction, phaseframes in ((friction, firstframes), (normalfriction, frames - firstframes)):
+            # Same as _slide(), for every speed that hasn't already stopped
+            steps = np.floor(absspeed / friction)
+            steps = np.where(absspeed - steps * friction < 0, steps - 1, steps)
+            steps = np.where(absspeed - (steps + 1) * friction >= 0, steps + 1, steps)
+            steps = np.where(stopped, 0, np.minimum(steps, phaseframes))
+            stopped |= steps < phaseframes
+            totaldistance += steps * absspeed - friction * steps * (steps + 1) / 2
+            absspeed = absspeed - steps * friction
+
+        return np.where(initspeeds < 0, -totaldistance, totaldistance)
@@ -1,9 +1,18 @@
-from melee import enums, stages
+from melee import enums, eventlayout, stages
 from melee.enums import Action, Character
 
 """Represents the state of a running game of Melee at a given moment in time"""
 class GameState:
-    def __init__(self, ai_port, opponent_port):
+    # Slotted, since these get made every frame and can pile up by the million
+    #   when kept around for datasets. It also means no setting new attributes
+    __slots__ = ('frame', 'stage', 'menu_state', 'player', 'projectiles',
+        'stage_select_cursor_x', 'stage_select_cursor_y', 'ready_to_start',
+        'distance', '_newframe', 'ai_state', 'opponent_state')
+
+    def __init__(self, ai_port, opponent_port, ports=range(1, 9)):
+        """ ports: Which controller ports to make PlayerStates for. The AI's and
+            opponent's ports always get one
+        """
         self.frame = 0
         self.stage = enums.Stage.FINAL_DESTINATION
         self.menu_state = enums.Menu.CHARACTER_SELECT
@@ -13,14 +22,8 @@ class GameState:
         self.stage_select_cursor_y = 0.0
         self.ready_to_start = False
         self.distance = 0.0
-        self.player[1] = PlayerState()
-        self.player[2] = PlayerState()
-        self.player[3] = PlayerState()
-        self.player[4] = PlayerState()
-        self.player[5] = PlayerState()
-        self.player[6] = PlayerState()
-        self.player[7] = PlayerState()
-        self.player[8] = PlayerState()
+        for port in sorted(set(ports) | {ai_port, opponent_port}):
+            self.player[port] = PlayerState()
         self._newframe = True
         #Helper names to keep track of us and our opponent
         self.ai_state = self.player[ai_port]
@@ -42,36 +45,60 @@ class GameState:
 
 """Represents the state of a single player"""
 class PlayerState:
+    # Everything that comes from POST_FRAME is decoded lazily, from the raw event
+    #   in _raw, the first time it's read. (See eventlayout.add_lazy_fields)
+    #   Those attributes are stored in slots with an underscore in front
+    __slots__ = ('character_selected', 'invulnerability_left',
+        'cursor_x', 'cursor_y', 'coin_down',
+        'controller_status', 'off_stage', 'transformed', 'iasa', 'moonwalkwarning',
+        'hitbox_1_size', 'hitbox_2_size', 'hitbox_3_size', 'hitbox_4_size',
+        'hitbox_1_status', 'hitbox_2_status', 'hitbox_3_status', 'hitbox_4_status',
+        'hitbox_1_x', 'hitbox_1_y', 'hitbox_2_x', 'hitbox_2_y',
+        'hitbox_3_x', 'hitbox_3_y', 'hitbox_4_x', 'hitbox_4_y', 'prev_action',
+        'inputs', '_next_x', '_next_y', '_prev_x', '_prev_y', '_raw', '_decoded') + \
+        eventlayout.lazy_slots(eventlayout.POST_FRAME_FIELDS)
+
     def __init__(self):
+        # The POST_FRAME event this player was last given, and which of its
+        #   fields have been decoded so far
+        self._raw = None
+        self._decoded = 0
+        # Defaults for the POST_FRAME attributes, for until there's an event.
+        #   (These set the slots directly, so they don't count as decoded)
         # This value is what the character currently is IN GAME
         #   So this will have no meaning while in menus
         #   Also, this will change dynamically if you change characters
         #       IE: Shiek/Zelda
-        self.character = enums.Character.UNKNOWN_CHARACTER
-        # This value is what character is selected at the character select screen
-        #   Don't use this value when in-game
-        self.character_selected = enums.Character.UNKNOWN_CHARACTER
-        self.x = 0
-        self.y = 0
-        self.percent = 0
-        self.stock = 0
+        self._character = enums.Character.UNKNOWN_CHARACTER
+        self._x = 0
+        self._y = 0
+        self._percent = 0
+        self._shield_strength = 60
+        self._last_attack_landed = 0
+        self._combo_count = 0
+        self._stock = 0
         # Facingis a bool here for convenience.
         #   True -> Facing right
         #   False -> Facing left
-        self.facing = True
-        self.action = enums.Action.UNKNOWN_ANIMATION
-        self.action_frame = 0
-        self.invulnerable = False
+        self._facing = True
+        self._action = enums.Action.UNKNOWN_ANIMATION
+        self._action_frame = 0
+        self._invulnerable = False
+        self._hitlag = False
+        self._hitlag_left = 0
+        self._hitstun_frames_left = 0
+        self._jumps_left = 0
+        self._on_ground = True
+        self._speed_air_x_self = 0
+        self._speed_y_self = 0
+        self._speed_x_attack = 0
+        self._speed_y_attack = 0
+        self._speed_ground_x_self = 0
+
+        # This value is what character is selected at the character select screen
+        #   Don't use this value when in-game
+        self.character_selected = enums.Character.UNKNOWN_CHARACTER
         self.invulnerability_left = 0
-        self.hitlag = False
-        self.hitstun_frames_left = 0
-        self.jumps_left = 0
-        self.on_ground = True
-        self.speed_air_x_self = 0
-        self.speed_y_self = 0
-        self.speed_x_attack = 0
-        self.speed_y_attack = 0
-        self.speed_ground_x_self = 0
         self.cursor_x = 0
         self.cursor_y = 0
         self.coin_down = False
@@ -97,12 +124,22 @@ class PlayerState:
         self.hitbox_4_x = 0
         self.hitbox_4_y = 0
         self.prev_action = Action.UNKNOWN_ANIMATION
+        # What the player's controller was doing this frame (from PRE_FRAME)
+        self.inputs = PlayerInputs()
 
         # For internal use only, ignore these
         self._next_x = 0
         self._next_y = 0
         self._prev_x = 0
-        self._prev_x = 0
+        self._prev_y = 0
+
+    def set_post_frame(self, event):
+        """ Hand this player a new raw POST_FRAME event (including its command byte)
+
+        Its fields get decoded from it as they're read
+        """
+        self._raw = event
+        self._decoded = 0
 
 
     """Produces a list representation of the player's state"""
@@ -126,9 +163,66 @@ class PlayerState:
         thelist.append(int(self.off_stage))
         return thelist
 
+eventlayout.add_lazy_fields(PlayerState, eventlayout.POST_FRAME_FIELDS)
+
+"""The controller inputs a player made on a given frame, as the game saw them"""
+class PlayerInputs:
+    __slots__ = ('buttons', 'buttons_physical', 'main_stick_x', 'main_stick_y',
+        'c_stick_x', 'c_stick_y', 'trigger', 'l_shoulder', 'r_shoulder')
+
+    # Bits of the processed buttons bitfield
+    BUTTON_MASKS = {
+        enums.Button.BUTTON_D_LEFT: 0x0001,
+        enums.Button.BUTTON_D_RIGHT: 0x0002,
+        enums.Button.BUTTON_D_DOWN: 0x0004,
+        enums.Button.BUTTON_D_UP: 0x0008,
+        enums.Button.BUTTON_Z: 0x0010,
+        enums.Button.BUTTON_R: 0x0020,
+        enums.Button.BUTTON_L: 0x0040,
+        enums.Button.BUTTON_A: 0x0100,
+        enums.Button.BUTTON_B: 0x0200,
+        enums.Button.BUTTON_X: 0x0400,
+        enums.Button.BUTTON_Y: 0x0800,
+        enums.Button.BUTTON_START: 0x1000,
+    }
+
+    def __init__(self):
+        # Bitfields of the buttons held down. The processed ones are after the
+        #   game's own handling (ie: Z also presses L and A), physical are not
+        self.buttons = 0
+        self.buttons_physical = 0
+        # Sticks go from 0 to 1, with (.5, .5) in the middle. Same as ControllerState
+        self.main_stick_x = .5
+        self.main_stick_y = .5
+        self.c_stick_x = .5
+        self.c_stick_y = .5
+        # Shoulders go from 0 to 1. The trigger is the processed analog value
+        #   of whichever of L or R is pressed further
+        self.trigger = 0
+        self.l_shoulder = 0
+        self.r_shoulder = 0
+
+    def pressed(self, button):
+        """Is the given (enums.Button) button held down, after processing"""
+        return bool(self.buttons & self.BUTTON_MASKS[button])
+
+    """Produces a list representation of the inputs"""
+    def tolist(self):
+        thelist = []
+        thelist.append(self.buttons)
+        thelist.append(self.main_stick_x)
+        thelist.append(self.main_stick_y)
+        thelist.append(self.c_stick_x)
+        thelist.append(self.c_stick_y)
+        thelist.append(self.l_shoulder)
+        thelist.append(self.r_shoulder)
+        return thelist
+
 """Represents the state of a projectile (items, lasers, etc...)"""
 class Projectile:
-    def __init(self):
+    __slots__ = ('x', 'y', 'x_speed', 'y_speed', 'opponent_owned', 'subtype')
+
+    def __init__(self):
         self.x = 0
         self.y = 0
         self.x_speed = 0
@@ -0,0 +1,62 @@
+""" Per-frame latency breakdown for Console
+
+With Console.time_frames on, every frame records how long it spent in each
+stage of getting from the socket to a finished GameState:
+    wait: Waiting on (and receiving from) the socket
+    decode: Decoding SlippiComm messages
+    parse: Handling the Slippi events in them
+    fixups: Console's fix-ups to the finished GameState
+The last `size` frames are kept in a ring buffer, to summarise with percentiles.
+"""
+
+from array import array
+
+STAGES = ("wait", "decode", "parse", "fixups")
+
+class LatencyLog:
+    def __init__(self, size=3600):
+        """ size: How many of the most recent frames to keep (3600 is a minute) """
+        self.size = size
+        # One ring buffer of seconds per stage, plus their total
+        self.times = {stage: array('d', bytes(8 * size)) for stage in STAGES + ("total",)}
+        # How many frames have been recorded, ever
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def record(self, wait, decode, parse, fixups):
+        """ Record one frame's time (in seconds) in each stage """
+        index = self.count % self.size
+        times = self.times
+        times["wait"][index] = wait
+        times["decode"][index] = decode
+        times["parse"][index] = parse
+        times["fixups"][index] = fixups
+        times["total"][index] = wait + decode + parse + fixups
+        self.count += 1
+
+    def percentiles(self, percents=(50, 95, 99)):
+        """ Returns a dict of stage to a dict of percent to milliseconds, over the
+        frames in the buffer. (Empty if nothing has been recorded yet)
+        """
+        frames = len(self)
+        if frames == 0:
+            return {}
+        summary = {}
+        for stage, times in self.times.items():
+            ordered = sorted(times[:frames])
+            summary[stage] = {percent: ordered[min(frames - 1, (percent * frames) // 100)] * 1000
+                              for percent in percents}
+        return summary
+
+    def summary(self, percents=(50, 95, 99)):
+        """ Returns the percentiles as a printable table """
+        lines = ["Latency over the last {} frames (ms):".format(len(self))]
+        lines.append("{:>8s}".format("") + "".join("{:>9s}".format("p" + str(p)) for p in percents))
+        for stage, values in self.percentiles(percents).items():
+            lines.append("{:>8s}".format(stage) + "".join("{:9.3f}".format(values[p]) for p in percents))
+        return "\n".join(lines)
+
+    def clear(self):
+        self.count = 0
@@ -0,0 +1,117 @@
+""" A local SlippiComm server that plays back a Slippstream capture file
+
+Record a capture by giving SlippstreamClient (or Console) a capture_path, then
+point Console.connect() at one of these on localhost to run the same stream
+through step() again, with no dolphin or Wii needed. Playback is deterministic:
+every client gets exactly the recorded messages, in order. A client that
+reconnects with a cursor picks up from the first recorded REPLAY message at or
+after that position, like it would with a real console.
+
+Can also be run on its own:
+    python3 -m melee.replayserver capture.slpcap --port 51441 --fast
+"""
+
+import argparse
+import socket
+import threading
+import time
+from struct import unpack
+
+import ubjson
+
+from melee.slippstream import read_capture, CommType
+
+class ReplayServer:
+    def __init__(self, path, address="127.0.0.1", port=51441, realtime=True):
+        """ path: The capture file to play back
+            port: Port to listen on. Use 0 to have the OS pick a free one
+            realtime: Send messages at the speed they were recorded at, instead
+                of as fast as possible
+        """
+        self.path = path
+        self.realtime = realtime
+        # Read it all in up front, so file IO doesn't get in the way of playback
+        self.messages = list(read_capture(path))
+        # The stream position of each message, for resuming. (None if it's
+        #   not a REPLAY message, so it has no position)
+        self.positions = [self.__position(message) for _, message in self.messages]
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((address, port))
+        self.server.listen(1)
+        self.address, self.port = self.server.getsockname()
+        self._thread = None
+
+    def start(self):
+        """ Serve clients from a background thread """
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+
+    def serve_forever(self):
+        """ Play the capture back to each client that connects, one at a time """
+        while True:
+            try:
+                client, _ = self.server.accept()
+            except OSError:
+                # The server socket was closed by stop()
+                return
+            with client:
+                self.serve(client)
+
+    def serve(self, client):
+        """ Play the capture back to a connected client """
+        try:
+            # Wait for the client's handshake before sending anything, like a real
+            #   console would. All we care about in it is where to start from
+            message_len = unpack(">L", self.__recv_exactly(client, 4))[0]
+            handshake = ubjson.loadb(self.__recv_exactly(client, message_len))
+            cursor = handshake.get("payload", {}).get("cursor", 0)
+            messages = self.messages
+            if cursor:
+                messages = [message for message, position in zip(self.messages, self.positions)
+                            if position is None or position >= cursor]
+
+            start = time.perf_counter()
+            first = messages[0][0] if messages else 0
+            for timestamp, message in messages:
+                if self.realtime:
+                    delay = (timestamp - first) - (time.perf_counter() - start)
+                    if delay > 0:
+                        time.sleep(delay)
+                client.sendall(message)
+        except ConnectionError:
+            print("Replay client disconnected")
+
+    def stop(self):
+        self.server.close()
+
+    def __position(self, message):
+        msg = ubjson.loadb(message[4:])
+        if msg.get("type") != CommType.REPLAY.value:
+            return None
+        return msg["payload"].get("pos")
+
+    def __recv_exactly(self, client, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = client.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("Client closed the connection")
+            data += chunk
+        return data
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play back a Slippstream capture file")
+    parser.add_argument("capture", help="Capture file to play back")
+    parser.add_argument("--address", "-a", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", "-p", type=int, default=51441, help="Port to listen on")
+    parser.add_argument("--fast", "-f", action="store_true",
+                        help="Send messages as fast as possible, instead of at recorded speed")
+    args = parser.parse_args()
+
+    server = ReplayServer(args.capture, args.address, args.port, realtime=not args.fast)
+    print("Playing back {} messages on {}:{}".format(len(server.messages), server.address, server.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
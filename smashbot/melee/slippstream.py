@@ -5,8 +5,12 @@ This can be used to talk to some server implementing the SlippiComm protocol
 (i.e. the Project Slippi fork of Nintendont).
 """
 
-from struct import pack, unpack
+from struct import pack, unpack, unpack_from, Struct
+import asyncio
+import json
+import os
 import socket
+import time
 from enum import Enum
 
 from ubjson.decoder import DecoderException
@@ -14,6 +18,7 @@ import ubjson
 
 from sys import argv
 from hexdump import hexdump
+from melee.commdecoder import DEFAULT_DECODER
 import signal
 import select
 import errno
@@ -39,11 +44,95 @@ class CommType(Enum):
 # The null token used for initial SlippiComm handshakes
 NULL_TOKEN = b'\x00\x00\x00\x00'
 
+# How long to wait between reconnect attempts. Doubles after every failure
+RECONNECT_MIN_DELAY = 0.05
+RECONNECT_MAX_DELAY = 2.0
+
+# Slippi consoles advertise themselves with a UDP broadcast to this port
+DISCOVERY_PORT = 20582
+# Consoles we've found before, so we can try them first next time
+DISCOVERY_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "libmelee", "consoles.json")
+# Only remember this many consoles (the most recently seen ones)
+DISCOVERY_CACHE_SIZE = 8
+# How long (in seconds) to wait for a cached console to accept a connection
+PROBE_TIMEOUT = 0.25
+
+# Initial size of the zero-copy receive buffer. A typical REPLAY message is a
+#   few hundred bytes, so this only grows for the GAME_START / GECKO_CODES dumps
+RECV_BUFFER_SIZE = 0x4000
+# Always leave at least this much room for read_available() to receive into
+RECV_CHUNK_SIZE = 0x1000
+
+# Capture files start with this, and then have one record per message received:
+#   A header of (time.time() it was received, message length), then the message
+CAPTURE_MAGIC = b'SLPCAP\x00\x01'
+CAPTURE_RECORD = Struct(">dL")
+
+def read_discovery_cache(path):
+    """ Returns the consoles in a discovery cache file, most recently seen first
+
+    Each one is a dict of address, nick and last_seen (a time.time()). A missing
+    or unreadable cache just has no consoles in it
+    """
+    if path is None:
+        return []
+    try:
+        with open(path) as cache:
+            consoles = json.load(cache)
+    except (OSError, ValueError):
+        return []
+    consoles = [c for c in consoles if isinstance(c, dict) and "address" in c]
+    return sorted(consoles, key=lambda c: c.get("last_seen", 0), reverse=True)
+
+def open_capture(path):
+    """ Open a capture file for appending messages to """
+    capture = open(path, "ab")
+    if capture.tell() == 0:
+        capture.write(CAPTURE_MAGIC)
+    return capture
+
+def read_capture(path):
+    """ Yields a (timestamp, message) tuple for each message in a capture file
+
+    The message is the raw length-prefixed SlippiComm message, as it was sent
+    """
+    with open(path, "rb") as capture:
+        if capture.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError("Not a Slippstream capture file: " + path)
+        while True:
+            header = capture.read(CAPTURE_RECORD.size)
+            if len(header) < CAPTURE_RECORD.size:
+                return
+            timestamp, message_len = CAPTURE_RECORD.unpack(header)
+            body = capture.read(message_len)
+            if len(body) < message_len:
+                return
+            yield timestamp, pack(">L", message_len) + body
+
 class SlippstreamClient(object):
     """ Container representing a client to some SlippiComm server """
 
-    def __init__(self, address="", port=51441, realtime=True):
-        """ Constructor for this object """
+    def __init__(self, address="", port=51441, realtime=True, zerocopy=False,
+                 capture_path=None, reconnect=False, reconnect_timeout=30,
+                 discovery_cache=DISCOVERY_CACHE_PATH, decoder=DEFAULT_DECODER):
+        """ Constructor for this object
+
+        zerocopy: Receive messages with recv_into() into a preallocated buffer
+            and decode them straight out of it, instead of building a new
+            bytearray for every message
+        capture_path: Append every message received to this file, so it can
+            be played back later with melee.replayserver
+        reconnect: If the connection drops, keep trying to reconnect (backing
+            off exponentially, for up to reconnect_timeout seconds) and resume
+            the stream from where we were cut off
+        discovery_cache: File to remember autodiscovered consoles in. When
+            there's no address, consoles in here are tried before waiting for
+            a broadcast. None to turn this off
+        decoder: Function that turns a message body into a dict. Defaults to
+            ubjson.loadb, or melee.commdecoder.decode_replay if ubjson's C
+            extension isn't available. (decode_replay hands back REPLAY data as
+            a memoryview into the receive buffer, only good until the next read)
+        """
 
         self.remote_addr = None
         self.remote_port = None
@@ -55,19 +144,68 @@ class SlippstreamClient(object):
         self.realtime = realtime
         self.address = address
         self.port = port
+        self.zerocopy = zerocopy
+        # Preallocated receive buffer for zerocopy mode. It only ever grows
+        self._recvbuf = bytearray(RECV_BUFFER_SIZE)
+        self._recvview = memoryview(self._recvbuf)
+        self._recvlen = 0
+        # Running count of message bytes copied around by the receive path
+        #   (Not counting the socket read itself, or what the decoder builds)
+        self.bytes_copied = 0
+        self.capture_path = capture_path
+        self._capture = None
+        # Where we are in the stream, and who the server thinks we are. Both
+        #   come from the server, and get handed back to it when reconnecting
+        self.cursor = 0
+        self.token = NULL_TOKEN
+        self.reconnect = reconnect
+        self.reconnect_timeout = reconnect_timeout
+        # How many times we've reconnected, and how long (in ms) the last
+        #   outage lasted. Measured up to the first REPLAY message back
+        self.reconnects = 0
+        self.reconnect_gap_ms = 0
+        # When the connection first dropped, and when to give up on it. These
+        #   (and the backoff) only reset once the stream actually resumes
+        self._disconnected_at = None
+        self._reconnect_deadline = None
+        self._reconnect_delay = RECONNECT_MIN_DELAY
+        # Set when read_available() loses the connection, which it can't wait
+        #   around to reconnect. The next read_message() reconnects instead
+        self._reconnect_pending = False
+        self.discovery_cache = discovery_cache
+        self.decoder = decoder
+        # Set to True to add up the seconds spent decoding messages in decode_time
+        self.time_decode = False
+        self.decode_time = 0
+        # Where the unread part of the receive buffer starts. read_available()
+        #   leaves the messages it returned in place until the next read
+        self._recvstart = 0
 
     def shutdown(self):
+        self.close_capture()
+        self._reconnect_pending = False
         if (self.server != None):
             self.server.close()
+            self.server = None
             return True
         else:
             return None
 
+    def close_capture(self):
+        """ Finish writing out the capture file, if there is one """
+        if self._capture is not None:
+            self._capture.close()
+            self._capture = None
+
     def read_message(self):
         """ Read an entire message from the registered socket.
 
         Returns None on failure, Dict of data from ubjson on success.
         """
+        if self.server is None:
+            reconnect, self._reconnect_pending = self._reconnect_pending, False
+            if not reconnect or not self.__reconnect():
+                return None
         while True:
             try:
                 rd, wr, exc = select.select(self.inp, self.out, self.inp)
@@ -76,40 +214,324 @@ class SlippstreamClient(object):
             except OSError as e:
                 if (e.args[0] == errno.EBADF):
                     print("Socket closed, shutting down")
+                    if self.__lost_connection():
+                        continue
                     return None
             for s in rd:
                 try:
-                    # The first 4 bytes are the message's length
-                    #   read this first
-                    while (len(self.buf) < 4):
-                        self.buf += s.recv(4 - len(self.buf))
-                    message_len = unpack(">L", self.buf[0:4])[0]
-
-                    # Now read in message_len amount of data
-                    while (len(self.buf) < (message_len + 4)):
-                        self.buf += s.recv((message_len + 4) - len(self.buf))
-
-                    try:
-                        # Exclude the the message length in the header
-                        msg = ubjson.loadb(self.buf[4:])
-                        # Clear out the old buffer
-                        del self.buf
-                        self.buf = bytearray()
-                        return msg
-
-                    except DecoderException as e:
-                        print("ERROR: Decode failure in Slippstream")
-                        print(e)
-                        print(hexdump(self.buf[4:]))
-                        self.buf.clear()
+                    # (read_available() may have left part of a message in the buffer)
+                    if self.zerocopy or self._recvlen:
+                        payload = self.__recv_zerocopy(s)
+                    else:
+                        payload = self.__recv_copy(s)
+                    if payload is None:
+                        print("Socket closed, shutting down")
+                        if self.__lost_connection():
+                            break
                         return None
-
                 except socket.error as e:
                     if (e.args[0] == errno.EWOULDBLOCK): continue
                     else:
                         print("ERROR with socket:", e)
+                        if self.__lost_connection():
+                            break
                         return None
 
+                return self._decode(payload)
+
+    def pending(self):
+        """ Returns True if there's data waiting to be read on the socket right now """
+        if (self.server == None):
+            return False
+        rd, wr, exc = select.select([self.server], [], [], 0)
+        return len(rd) > 0
+
+    def read_available(self):
+        """ Read whatever has arrived on a non-blocking socket, without waiting
+
+        For multiplexing lots of clients with select/epoll. Returns a list of the
+        complete messages received so far (maybe empty), or None if the socket
+        was closed. Partial messages are kept around until the rest arrives.
+        This never reconnects, since that would block. (With reconnect on, the
+        next read_message() does)
+        """
+        if self.server is None:
+            return None
+        self.__compact()
+        if len(self._recvbuf) - self._recvlen < RECV_CHUNK_SIZE:
+            self.__grow_buffer(self._recvlen + RECV_CHUNK_SIZE)
+        try:
+            received = self.server.recv_into(self._recvview[self._recvlen:])
+        except BlockingIOError:
+            return []
+        except socket.error as e:
+            print("ERROR with socket:", e)
+            self.shutdown()
+            self._reconnect_pending = self.reconnect
+            return None
+        if received == 0:
+            print("Socket closed, shutting down")
+            self.shutdown()
+            self._reconnect_pending = self.reconnect
+            return None
+        self._recvlen += received
+
+        messages = []
+        start = 0
+        while (self._recvlen - start) >= 4:
+            message_len = unpack_from(">L", self._recvbuf, start)[0]
+            end = start + 4 + message_len
+            if end > self._recvlen:
+                break
+            msg = self._decode(self._recvview[start + 4:end])
+            if msg:
+                messages.append(msg)
+            start = end
+        self._recvstart = start
+        return messages
+
+    def _decode(self, payload):
+        """ Decode the body of a message. Returns None on failure """
+        if self.capture_path:
+            if self._capture is None:
+                self._capture = open_capture(self.capture_path)
+            self._capture.write(CAPTURE_RECORD.pack(time.time(), len(payload)))
+            self._capture.write(payload)
+        start = time.perf_counter() if self.time_decode else 0
+        try:
+            msg = self.decoder(payload)
+        except DecoderException as e:
+            print("ERROR: Decode failure in Slippstream")
+            print(e)
+            print(hexdump(bytes(payload)))
+            return None
+        if self.time_decode:
+            self.decode_time += time.perf_counter() - start
+        self._track_cursor(msg)
+        return msg
+
+    def _track_cursor(self, msg):
+        """ Keep track of the stream position and client token, to resume from """
+        msg_type = msg.get('type')
+        if msg_type == CommType.REPLAY.value:
+            cursor = msg['payload'].get('nextPos', self.cursor)
+            if self._disconnected_at is not None and cursor != self.cursor:
+                self.reconnect_gap_ms = (time.time() - self._disconnected_at) * 1000
+                self._disconnected_at = None
+                self._reconnect_deadline = None
+                self._reconnect_delay = RECONNECT_MIN_DELAY
+            self.cursor = cursor
+        elif msg_type == CommType.HANDSHAKE.value:
+            self.token = msg['payload'].get('clientToken', self.token)
+
+    def __lost_connection(self):
+        """ Shut down the dead connection, and reconnect if we're meant to
+
+        Returns True if we're connected again
+        """
+        self.shutdown()
+        return self.reconnect and self.__reconnect()
+
+    def __reconnect(self):
+        """ Try to connect again, backing off exponentially between attempts
+
+        Returns True on success, False if we ran out of time. A connection that
+        drops again before the stream resumes (say, a console that accepts us
+        and then hangs up) keeps counting down the same deadline and backoff
+        """
+        if self._disconnected_at is None:
+            self._disconnected_at = time.time()
+            self._reconnect_deadline = self._disconnected_at + self.reconnect_timeout
+            self._reconnect_delay = RECONNECT_MIN_DELAY
+        deadline = self._reconnect_deadline
+        while time.time() < deadline:
+            time.sleep(min(self._reconnect_delay, max(0, deadline - time.time())))
+            self._reconnect_delay = min(self._reconnect_delay * 2, RECONNECT_MAX_DELAY)
+            print("Reconnecting to Slippi at {}:{}...".format(self.address, self.port))
+            if self.connect():
+                self.reconnects += 1
+                return True
+        print("ERROR: Gave up reconnecting to Slippi after {} seconds".format(self.reconnect_timeout))
+        self._disconnected_at = None
+        self._reconnect_deadline = None
+        return False
+
+    def __recv_copy(self, s):
+        """ Read one message by appending socket reads onto a fresh bytearray
+
+        Returns the message body (without its length header), or None if the
+        socket was closed.
+        """
+        # The first 4 bytes are the message's length
+        #   read this first
+        while (len(self.buf) < 4):
+            chunk = s.recv(4 - len(self.buf))
+            if not chunk:
+                return None
+            self.buf += chunk
+            self.bytes_copied += len(chunk)
+        message_len = unpack(">L", self.buf[0:4])[0]
+
+        # Now read in message_len amount of data
+        while (len(self.buf) < (message_len + 4)):
+            chunk = s.recv((message_len + 4) - len(self.buf))
+            if not chunk:
+                return None
+            self.buf += chunk
+            self.bytes_copied += len(chunk)
+
+        # Exclude the the message length in the header
+        payload = self.buf[4:]
+        self.bytes_copied += message_len
+        # Clear out the old buffer
+        del self.buf
+        self.buf = bytearray()
+        return payload
+
+    def __recv_zerocopy(self, s):
+        """ Read one message directly into the preallocated receive buffer
+
+        Returns a memoryview of the message body (without its length header),
+        or None if the socket was closed. The view is only valid until the
+        next message is read.
+        """
+        self.__compact()
+        # The first 4 bytes are the message's length
+        while (self._recvlen < 4):
+            if not self.__recv_into(s, 4):
+                return None
+        message_len = unpack_from(">L", self._recvbuf)[0]
+
+        if (message_len + 4) > len(self._recvbuf):
+            self.__grow_buffer(message_len + 4)
+
+        # Now read in message_len amount of data
+        while (self._recvlen < (message_len + 4)):
+            if not self.__recv_into(s, message_len + 4):
+                return None
+
+        self._recvlen = 0
+        return self._recvview[4:message_len + 4]
+
+    def __compact(self):
+        """ Move what's left of a partial message (after the messages that
+        read_available() returned) to the front of the buffer
+        """
+        start = self._recvstart
+        if start == 0:
+            return
+        self._recvstart = 0
+        remaining = bytes(self._recvview[start:self._recvlen])
+        self._recvbuf[:len(remaining)] = remaining
+        self._recvlen = len(remaining)
+        self.bytes_copied += len(remaining)
+
+    def __recv_into(self, s, end):
+        """ Receive up to the given buffer offset. Returns False if the socket closed """
+        received = s.recv_into(self._recvview[self._recvlen:end])
+        self._recvlen += received
+        return received > 0
+
+    def __grow_buffer(self, size):
+        """ Reallocate the receive buffer to hold at least size bytes """
+        newbuf = bytearray(max(size, 2 * len(self._recvbuf)))
+        newbuf[:self._recvlen] = self._recvview[:self._recvlen]
+        self.bytes_copied += self._recvlen
+        self._recvbuf = newbuf
+        self._recvview = memoryview(newbuf)
+
+    def discover(self):
+        """ Autodiscover a Slippi console on the local network
+
+        Consoles found before (in the discovery cache) are probed first, and
+        only if none of them answer do we wait for a broadcast.
+
+        Returns True on success (and sets the address), False on failure
+        """
+        if self.__probe_cached():
+            return True
+
+        # Slippi broadcasts a UDP message on port
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # Slippi sends an advertisement every 10 seconds. So 20 should be enough
+        sock.settimeout(20)
+        sock.bind(('', DISCOVERY_PORT))
+        try:
+            print("Trying to autodiscover Slippi...")
+            message = sock.recvfrom(1024)
+            self.address = message[1][0]
+            print("Found Slippi at IP address: ", self.address)
+        except socket.timeout:
+            print("ERROR: Could not autodiscover a slippi console, and " +
+                "no address was given. Make sure the Wii/Slippi console is on " +
+                "and/or supply a known IP address")
+            return False
+        finally:
+            sock.close()
+        # The broadcast is "SLIP_READY", then the console's MAC and nickname
+        nick = message[0][16:48].split(b'\x00')[0].decode("utf-8", "replace")
+        self.__remember_console(self.address, nick)
+        return True
+
+    def __probe_cached(self):
+        """ Try connecting to every console in the discovery cache at once, and
+        take the first one that accepts
+
+        Returns True on success (and sets the address), False otherwise
+        """
+        consoles = read_discovery_cache(self.discovery_cache)
+        if not consoles:
+            return False
+
+        probes = {}
+        for console in consoles:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            error = sock.connect_ex((console["address"], self.port))
+            if error in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                probes[sock] = console
+            else:
+                sock.close()
+
+        found = None
+        deadline = time.time() + PROBE_TIMEOUT
+        try:
+            while probes and found is None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                _, writable, _ = select.select([], list(probes), [], remaining)
+                for sock in writable:
+                    console = probes.pop(sock)
+                    error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    sock.close()
+                    if error == 0:
+                        found = console
+                        break
+        finally:
+            for sock in probes:
+                sock.close()
+
+        if found is None:
+            return False
+        self.address = found["address"]
+        print("Found Slippi at cached IP address: ", self.address)
+        self.__remember_console(self.address, found.get("nick", ""))
+        return True
+
+    def __remember_console(self, address, nick):
+        """ Add (or refresh) a console in the discovery cache """
+        if self.discovery_cache is None:
+            return
+        consoles = [c for c in read_discovery_cache(self.discovery_cache) if c["address"] != address]
+        consoles.insert(0, {"address": address, "nick": nick, "last_seen": time.time()})
+        try:
+            os.makedirs(os.path.dirname(self.discovery_cache) or ".", exist_ok=True)
+            with open(self.discovery_cache, "w") as cache:
+                json.dump(consoles[:DISCOVERY_CACHE_SIZE], cache, indent=2)
+        except OSError as e:
+            print("WARNING: Could not save the Slippi discovery cache:", e)
+
     def connect(self):
         """ Connect to the server
 
@@ -117,36 +539,29 @@ class SlippstreamClient(object):
         """
 
         # If we don't have a slippi address, let's autodiscover it
-        if not self.address:
-            # Slippi broadcasts a UDP message on port
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            # Slippi sends an advertisement every 10 seconds. So 20 should be enough
-            sock.settimeout(20)
-            sock.bind(('', 20582))
-            try:
-                print("Trying to autodiscover Slippi...")
-                message = sock.recvfrom(1024)
-                self.address = message[1][0]
-                print("Found Slippi at IP address: ", self.address)
-            except socket.timeout:
-                print("ERROR: Could not autodiscover a slippi console, and " +
-                    "no address was given. Make sure the Wii/Slippi console is on " +
-                    "and/or supply a known IP address")
-                return False
+        if not self.address and not self.discover():
+            return False
 
         if (self.server != None):
             print("Connection already established")
             return True
 
+        # Anything left over from an old connection is useless now
+        self.buf = bytearray()
+        self._recvlen = 0
+        self._recvstart = 0
+
         # Try to connect to the server and send a handshake
+        #   (Resuming from wherever we were, if this is a reconnect)
         self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
             self.server.connect((self.address, self.port))
-            self.server.send(self.__new_handshake())
+            self.server.send(self._new_handshake(self.cursor, self.token))
         except socket.error as e:
             print(e)
             if (e.args[0] == errno.ECONNREFUSED):
                 print("Returned ECONNREFUSED ({}:{})".format(self.address, self.port))
+            self.shutdown()
             return False
 
         self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -155,7 +570,7 @@ class SlippstreamClient(object):
         self.out = []
         return True
 
-    def __new_handshake(self, cursor=0, token=NULL_TOKEN):
+    def _new_handshake(self, cursor=0, token=NULL_TOKEN):
         """ Returns a new binary handshake message """
         handshake = bytearray()
         handshake_contents = ubjson.dumpb({
@@ -170,6 +585,95 @@ class SlippstreamClient(object):
         handshake += handshake_contents
         return handshake
 
+class AsyncSlippstreamClient(SlippstreamClient):
+    """ A SlippiComm client for use inside an asyncio event loop
+
+    connect() and read_message() are coroutines here, so waiting on the console
+    doesn't block anything else running in the loop. Messages can also be read
+    with `async for msg in client`, which stops once the connection closes.
+    """
+
+    def __init__(self, address="", port=51441, realtime=True, capture_path=None):
+        """ Constructor for this object """
+        super().__init__(address, port, realtime, capture_path=capture_path)
+        self.reader = None
+        self.writer = None
+
+    def shutdown(self):
+        self.close_capture()
+        if (self.writer != None):
+            self.writer.close()
+            self.writer = None
+            self.reader = None
+            return True
+        else:
+            return None
+
+    async def read_message(self):
+        """ Read an entire message from the connection.
+
+        Returns None on failure, Dict of data from ubjson on success.
+        """
+        if (self.reader == None):
+            return None
+        try:
+            # The first 4 bytes are the message's length
+            header = await self.reader.readexactly(4)
+            message_len = unpack(">L", header)[0]
+            payload = await self.reader.readexactly(message_len)
+            # StreamReader copies both out of its own buffer
+            self.bytes_copied += message_len + 4
+        except asyncio.IncompleteReadError:
+            print("Socket closed, shutting down")
+            self.shutdown()
+            return None
+        except socket.error as e:
+            print("ERROR with socket:", e)
+            self.shutdown()
+            self.reader = self.writer = None
+            return None
+
+        return self._decode(payload)
+
+    async def connect(self):
+        """ Connect to the server
+
+        Returns True on success, False on failure
+        """
+        # If we don't have a slippi address, let's autodiscover it
+        #   (in a thread, since that waits on a blocking UDP socket)
+        if not self.address:
+            loop = asyncio.get_running_loop()
+            if not await loop.run_in_executor(None, self.discover):
+                return False
+
+        if (self.writer != None):
+            print("Connection already established")
+            return True
+
+        # Try to connect to the server and send a handshake
+        try:
+            self.reader, self.writer = await asyncio.open_connection(self.address, self.port)
+            self.writer.write(self._new_handshake(self.cursor, self.token))
+            await self.writer.drain()
+        except socket.error as e:
+            print(e)
+            if (e.args[0] == errno.ECONNREFUSED):
+                print("Returned ECONNREFUSED ({}:{})".format(self.address, self.port))
+            self.shutdown()
+            return False
+        return True
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while self.reader != None:
+            msg = await self.read_message()
+            if msg:
+                return msg
+        raise StopAsyncIteration
+
 def get_sigint_handler(client):
     """ Return a SIGINT handler for the provided SlippiCommClient object """
     def handler(signum, stack):